@@ -1,28 +1,363 @@
 import sys
 import json
-from threading import Thread
-from time import sleep
+import struct
+import asyncio
+from collections import deque
+from threading import Thread, Lock
+from time import sleep, monotonic
 from datetime import datetime
 import signal
 
+import numpy as np
+
 # those modules are imported dynamically during runtime
 # they are imported only if the corresponding class is used
 #import socket
 #import serial
 #import wiimote
 
+# optional, faster json backend; the standard json module is used without it
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+# capabilities with {"x": ..., "y": ..., "z": ...} values
+# their samples are stored as (timestamp, x, y, z) rows of a VectorQueue
+VECTOR_CAPABILITIES = frozenset(('accelerometer', 'gyroscope', 'gravity'))
+
+# value of a capability before its first sample arrived
+_NO_VALUE = []
+
+# compact binary frames, an alternative to json frames
+# header: magic (2 bytes), version (uint8), section flags (uint8)
+# followed by the sections whose flag is set, in this order:
+# accelerometer, gyroscope, gravity: x, y, z as float32 each
+# buttons: number of buttons (uint8), bitmask (uint32, bit 0 = button_1)
+# all values are little endian
+# json frames never start with the first magic byte, so both formats
+# can be told apart per packet
+BINARY_MAGIC = b'\xd1\x99'
+BINARY_VERSION = 1
+BINARY_VECTOR_SECTIONS = ('accelerometer', 'gyroscope', 'gravity')
+BINARY_FLAG_BUTTONS = 1 << len(BINARY_VECTOR_SECTIONS)
+_BINARY_HEADER = struct.Struct('<2sBB')
+_BINARY_VECTOR = struct.Struct('<3f')
+_BINARY_BUTTONS = struct.Struct('<BI')
+
+# packs a dict such as {'accelerometer': {'x': 0, 'y': 0, 'z': 1}, 'button_1': 0}
+# into a binary frame; other capabilities cannot be represented and are ignored
+def encode_binary_frame(values):
+    flags = 0
+    body = b''
+    for bit, key in enumerate(BINARY_VECTOR_SECTIONS):
+        if key in values:
+            flags |= 1 << bit
+            vector = values[key]
+            body += _BINARY_VECTOR.pack(vector['x'], vector['y'], vector['z'])
+
+    buttons = 0
+    while f'button_{buttons + 1}' in values:
+        buttons += 1
+    if buttons:
+        flags |= BINARY_FLAG_BUTTONS
+        mask = 0
+        for i in range(buttons):
+            if values[f'button_{i + 1}']:
+                mask |= 1 << i
+        body += _BINARY_BUTTONS.pack(buttons, mask)
+
+    return _BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, flags) + body
+
+# for each combination of section flags, a struct for the whole frame and
+# the vector sections it contains
+_binary_layouts = {}
+
+def _binary_layout(flags):
+    layout = _binary_layouts.get(flags)
+    if layout is None:
+        keys = [key for bit, key in enumerate(BINARY_VECTOR_SECTIONS) if flags & (1 << bit)]
+        fmt = _BINARY_HEADER.format + '3f' * len(keys)
+        if flags & BINARY_FLAG_BUTTONS:
+            fmt += _BINARY_BUTTONS.format[1:]
+        layout = (struct.Struct(fmt), keys)
+        _binary_layouts[flags] = layout
+    return layout
+
+# returns the total size of a binary frame from its header
+# raises ValueError if the header is invalid
+def binary_frame_size(header):
+    if len(header) < _BINARY_HEADER.size:
+        raise ValueError('incomplete header')
+    magic, version, flags = _BINARY_HEADER.unpack_from(header)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError('not a binary DIPPID frame')
+    return _binary_layout(flags)[0].size
+
+# unpacks a binary frame into the same dict a json frame decodes to
+# raises ValueError if the frame is malformed
+def decode_binary_frame(data):
+    if binary_frame_size(data) != len(data):
+        raise ValueError('wrong frame size')
+
+    layout, keys = _binary_layout(data[3])
+    fields = layout.unpack(data)
+    values = {}
+    i = 3
+    for key in keys:
+        values[key] = {'x': fields[i], 'y': fields[i + 1], 'z': fields[i + 2]}
+        i += 3
+
+    if i < len(fields):
+        buttons, mask = fields[i], fields[i + 1]
+        for button in range(buttons):
+            values[f'button_{button + 1}'] = (mask >> button) & 1
+    return values
+
+# for each combination of section flags, a numpy dtype of the whole frame, so
+# a run of frames with the same layout is decoded with one np.frombuffer()
+_binary_dtypes = {}
+
+def _binary_dtype(flags):
+    dtype = _binary_dtypes.get(flags)
+    if dtype is None:
+        layout, keys = _binary_layout(flags)
+        fields = [('header', 'V4')] + [(key, '<f4', (3,)) for key in keys]
+        if flags & BINARY_FLAG_BUTTONS:
+            fields += [('buttons', 'u1'), ('mask', '<u4')]
+        dtype = np.dtype(fields)
+        assert dtype.itemsize == layout.size
+        _binary_dtypes[flags] = dtype
+    return dtype
+
+# the layout of a binary frame, frames with the same key can be decoded together
+def _binary_run_key(data):
+    if data[3] & BINARY_FLAG_BUTTONS:
+        # frames may differ in their number of buttons
+        return data[:4], len(data), data[-5]
+    return data[:4], len(data)
+
+# fixed-size queue of (timestamp, x, y, z) samples in a preallocated float64
+# array; once it is full the oldest samples are overwritten
+# blocks of samples (binary frames) are copied into the array directly, single
+# samples (json frames) are appended to a deque first and copied in one block
+# when the queue is drained, numpy is slow for one row at a time
+# append() and extend() may run on another thread than drain()
+class VectorQueue():
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._rows = np.zeros((maxlen, 4))
+        self._start = 0
+        # number of samples in the array
+        self.stored = 0
+        # samples not yet copied into the array
+        self.pending = deque(maxlen=maxlen)
+        # appends a (timestamp, x, y, z) tuple of floats, atomic like deque.append()
+        self.append = self.pending.append
+        self._lock = Lock()
+
+    def __len__(self):
+        return min(self.stored + len(self.pending), self.maxlen)
+
+    # appends the rows of an n x 4 array
+    def extend(self, rows):
+        with self._lock:
+            self._flush()
+            self._extend(rows)
+
+    # removes and returns all samples as an n x 4 array, oldest first
+    def drain(self):
+        with self._lock:
+            self._flush()
+            start, count = self._start, self.stored
+            first = min(count, self.maxlen - start)
+            rows = np.concatenate((self._rows[start:start + first], self._rows[:count - first]))
+            self._start = (start + count) % self.maxlen
+            self.stored = 0
+        return rows
+
+    # must be called with the lock held
+    # deque.popleft() is atomic, so this is safe while another thread appends
+    def _flush(self):
+        pending = self.pending
+        count = len(pending)
+        if count:
+            self._extend(np.array([pending.popleft() for _ in range(count)], dtype=np.float64))
+
+    # must be called with the lock held
+    def _extend(self, rows):
+        rows = rows[-self.maxlen:]
+        n = len(rows)
+        end = (self._start + self.stored) % self.maxlen
+        first = min(n, self.maxlen - end)
+        self._rows[end:end + first] = rows[:first]
+        self._rows[:n - first] = rows[first:]
+        self.stored = min(self.stored + n, self.maxlen)
+        self._start = (end + n - self.stored) % self.maxlen
+
+# recorded DIPPID streams, written by SensorRecorder and replayed by SensorReplay
+# header: magic (4 bytes), version (uint8)
+# followed by one record per received frame: time since the previous
+# frame in microseconds (uint32), frame length (uint16) and the raw frame
+# as it was received (json or binary); all values are little endian
+LOG_MAGIC = b'DPLG'
+LOG_VERSION = 1
+_LOG_HEADER = struct.Struct('<4sB')
+_LOG_RECORD = struct.Struct('<IH')
+_LOG_MAX_DELTA = 0xFFFFFFFF
+
+# writes the raw frames of a sensor with their receive times to a log file
+# usually created by Sensor.record(); write() is thread-safe
+class SensorRecorder():
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(_LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+        self._lock = Lock()
+        self._start = None
+        # time of the previous record in microseconds since the start
+        self._last = 0
+
+    # frames (str or bytes) received at the same time (monotonic() by default)
+    def write(self, frames, timestamp=None):
+        if timestamp is None:
+            timestamp = monotonic()
+        with self._lock:
+            if self._file.closed:
+                return
+            if self._start is None:
+                self._start = timestamp
+            now = int((timestamp - self._start) * 1e6)
+            delta = min(max(now - self._last, 0), _LOG_MAX_DELTA)
+            self._last += delta
+            for frame in frames:
+                if isinstance(frame, str):
+                    frame = frame.encode()
+                self._file.write(_LOG_RECORD.pack(delta, len(frame)))
+                self._file.write(frame)
+                delta = 0
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+# yields the frames of a log file as (seconds since the start, frame) tuples
+# raises ValueError if the file is not a log
+def read_log(path):
+    with open(path, 'rb') as f:
+        header = f.read(_LOG_HEADER.size)
+        if len(header) != _LOG_HEADER.size or _LOG_HEADER.unpack(header) != (LOG_MAGIC, LOG_VERSION):
+            raise ValueError(f'{path} is not a DIPPID log')
+        time = 0
+        while True:
+            record = f.read(_LOG_RECORD.size)
+            if len(record) < _LOG_RECORD.size:
+                return
+            delta, size = _LOG_RECORD.unpack(record)
+            frame = f.read(size)
+            if len(frame) < size:
+                # truncated by a crash while recording
+                return
+            time += delta
+            yield time / 1e6, frame
+
+# dispatchers decide on which thread and how often callbacks run
+# a sensor hands every change to its dispatcher via
+# dispatch(key, callbacks, value), where key identifies sensor and capability
+
+def _run_callbacks(callbacks, value):
+    for func in callbacks:
+        func(value)
+
+# runs callbacks immediately on the receiving thread (the default)
+class InlineDispatcher():
+    def dispatch(self, key, callbacks, value):
+        _run_callbacks(callbacks, value)
+
+    def close(self):
+        pass
+
+# runs callbacks on a pool of worker threads, so slow callbacks
+# do not stall receiving; callbacks may run concurrently
+class ExecutorDispatcher():
+    def __init__(self, max_workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def dispatch(self, key, callbacks, value):
+        self._executor.submit(_run_callbacks, callbacks, value)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+# keeps at most one pending update per capability: values that arrive
+# while an update is still pending replace it, so slow callbacks only ever
+# see the newest value
+# schedule(func) must run func later on another thread (or event loop);
+# by default a single worker thread is used
+class CoalescingDispatcher():
+    def __init__(self, schedule=None):
+        self._executor = None
+        if schedule is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            schedule = self._executor.submit
+        self._schedule = schedule
+        self._pending = {}
+        self._lock = Lock()
+
+    def dispatch(self, key, callbacks, value):
+        with self._lock:
+            already_scheduled = key in self._pending
+            self._pending[key] = (callbacks, value)
+        if not already_scheduled:
+            self._schedule(lambda: self._deliver(key))
+
+    def _deliver(self, key):
+        with self._lock:
+            callbacks, value = self._pending.pop(key)
+        _run_callbacks(callbacks, value)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+_inline_dispatcher = InlineDispatcher()
+
 class Sensor():
     # class variable that stores all instances of Sensor
     instances = []
 
-    def __init__(self):
+    # default number of samples kept per capability until they are drained
+    QUEUE_SIZE = 1024
+
+    def __init__(self, queue_size=QUEUE_SIZE):
         # list of strings which represent capabilites, such as 'buttons' or 'accelerometer'
         self._capabilities = []
         # for each capability, store a list of callback functions
         self._callbacks = {}
         # for each capability, store the last value as an object
         self._data = {}
+        # for each capability, store every received value with its
+        # timestamp until it is drained; the oldest samples are discarded
+        # once queue_size is exceeded. vector capabilities are stored in a
+        # VectorQueue, all others in a deque of (timestamp, value) tuples
+        self._queue_size = queue_size
+        self._samples = {}
+        # for each vector capability, the last value as an (x, y, z) tuple
+        self._vectors = {}
+        # packet counters: received frames, frames with samples discarded
+        # from a full queue and frames that could not be decoded
+        # only queues that were drained at least once count as dropping,
+        # the others just keep the newest samples of an unused capability
+        self._stats = {'received': 0, 'dropped': 0, 'malformed': 0}
+        self._drained = set()
+        self._dispatcher = _inline_dispatcher
+        # writes every received frame to a log while recording, see record()
+        self._recorder = None
         self._receiving = False
+        self._connection_thread = None
         Sensor.instances.append(self)
 
     # stops the loop in _receive() and kills the thread
@@ -32,39 +367,226 @@ class Sensor():
         Sensor.instances.remove(self)
         if self._connection_thread:
             self._connection_thread.join()
+        self.stop_recording()
+
+    # writes every frame received from now on to a log file,
+    # which SensorReplay can replay
+    def record(self, path):
+        self.stop_recording()
+        self._recorder = SensorRecorder(path)
+
+    def stop_recording(self):
+        recorder = self._recorder
+        self._recorder = None
+        if recorder is not None:
+            recorder.close()
 
     # runs as a thread
     # receives json formatted data from sensor,
     # stores it and notifies callbacks
     def _update(self, data):
+        self._update_batch((data,))
+
+    # decodes several json or binary frames (str or bytes) at once and stores
+    # every sample, but notifies callbacks only once per changed capability
+    # with the newest value of the batch
+    # runs of binary frames with the same layout are decoded together, straight
+    # into numeric arrays (see _apply_binary_run())
+    # samples are stamped with the receive time unless timestamps are given
+    def _update_batch(self, frames, timestamps=None):
+        recorder = self._recorder
+        if recorder is not None:
+            recorder.write(frames)
+
+        changed = {}
+        run = []
+        run_times = []
+        run_key = None
+        for i, data in enumerate(frames):
+            timestamp = monotonic() if timestamps is None else timestamps[i]
+            if data[:1] == BINARY_MAGIC[:1] and len(data) >= _BINARY_HEADER.size:
+                key = _binary_run_key(data)
+                if key != run_key and run:
+                    self._apply_binary_run(run, run_times, changed)
+                    run, run_times = [], []
+                run_key = key
+                run.append(data)
+                run_times.append(timestamp)
+                continue
+
+            if run:
+                self._apply_binary_run(run, run_times, changed)
+                run, run_times, run_key = [], [], None
+            data_json = self._decode(data)
+            if data_json is not None:
+                self._apply(data_json, timestamp, changed)
+        if run:
+            self._apply_binary_run(run, run_times, changed)
+
+        for key in changed:
+            self._notify_callbacks(key)
+
+    # decodes binary frames that share one layout with a single np.frombuffer()
+    # and appends every section as a block; frames that are not valid binary
+    # frames go through _decode()
+    def _apply_binary_run(self, frames, timestamps, changed):
+        data = frames[0]
         try:
-            data_json = json.loads(data)
-        except json.decoder.JSONDecodeError:
-            # incomplete data
+            valid = binary_frame_size(data) == len(data)
+        except ValueError:
+            valid = False
+        if not valid or len(frames) == 1:
+            for data, timestamp in zip(frames, timestamps):
+                data_json = self._decode(data)
+                if data_json is not None:
+                    self._apply(data_json, timestamp, changed)
             return
 
-        for key, value in data_json.items():
+        self._stats['received'] += len(frames)
+        flags = data[3]
+        records = np.frombuffer(b''.join(frames), dtype=_binary_dtype(flags))
+        times = np.array(timestamps, dtype=np.float64)
+        # frames that overflowed a queue, a suffix of the run
+        dropped = 0
+        for key in _binary_layout(flags)[1]:
+            rows = np.empty((len(frames), 4))
+            rows[:, 0] = times
+            rows[:, 1:] = records[key]
+            dropped = max(dropped, self._extend_vectors(key, rows, changed))
+        if flags & BINARY_FLAG_BUTTONS:
+            masks = records['mask']
+            times = times.tolist()
+            for button in range(records['buttons'][0]):
+                values = ((masks >> button) & 1).tolist()
+                dropped = max(dropped, self._extend_values(f'button_{button + 1}', times, values, changed))
+        self._stats['dropped'] += dropped
+
+    # number of samples that will not fit into the queue of a drained capability
+    def _overflow(self, key, queue, count):
+        if key not in self._drained:
+            return 0
+        return max(len(queue) + count - queue.maxlen, 0)
+
+    # appends the rows (n x 4) of a vector capability, returns the overflow
+    def _extend_vectors(self, key, rows, changed):
+        if key not in self._data:
+            self._add_capability(key)
+        queue = self._samples[key]
+        overflow = self._overflow(key, queue, len(rows))
+        queue.extend(rows)
+
+        previous = self._vectors.get(key)
+        baseline = rows[0, 1:] if previous is None else previous
+        if not (rows[:, 1:] == baseline).all():
+            changed[key] = True
+        x, y, z = rows[-1, 1:].tolist()
+        self._vectors[key] = (x, y, z)
+        self._data[key] = {'x': x, 'y': y, 'z': z}
+        return overflow
+
+    # appends the values of a scalar capability, returns the overflow
+    def _extend_values(self, key, timestamps, values, changed):
+        if key not in self._data:
             self._add_capability(key)
+        queue = self._samples[key]
+        overflow = self._overflow(key, queue, len(values))
+        queue.extend(zip(timestamps, values))
 
-            # do not notify callbacks on initialization
-            if self._data[key] == []:
-                self._data[key] = value
+        previous = self._data[key]
+        baseline = values[0] if previous is _NO_VALUE else previous
+        if any(value != baseline for value in values):
+            changed[key] = True
+        self._data[key] = values[-1]
+        return overflow
+
+    # same as _update_batch() for frames that were already decoded
+    # elsewhere, given as (timestamp, dict) tuples
+    def _update_decoded(self, items):
+        changed = {}
+        for timestamp, data_json in items:
+            self._stats['received'] += 1
+            self._apply(data_json, timestamp, changed)
+
+        for key in changed:
+            self._notify_callbacks(key)
+
+    # returns the decoded json or binary frame as a dict,
+    # or None if it is malformed
+    def _decode(self, data):
+        self._stats['received'] += 1
+        try:
+            if data[:1] == BINARY_MAGIC[:1]:
+                return decode_binary_frame(data)
+            data_json = _json_loads(data)
+        except ValueError:
+            # incomplete data or invalid encoding
+            self._stats['malformed'] += 1
+            return None
+        if not isinstance(data_json, dict):
+            self._stats['malformed'] += 1
+            return None
+        return data_json
+
+    # stores the values of one frame and collects changed capabilities
+    # as keys of the dict changed
+    def _apply(self, data_json, timestamp, changed):
+        data = self._data
+        vectors = self._vectors
+        dropped = False
+        for key, value in data_json.items():
+            if key not in data:
+                self._add_capability(key)
+            queue = self._samples[key]
+            if key in VECTOR_CAPABILITIES:
+                try:
+                    vector = (float(value['x']), float(value['y']), float(value['z']))
+                except (KeyError, TypeError, ValueError):
+                    # not a vector or not numeric
+                    self._stats['malformed'] += 1
+                    continue
+                # same as len(queue), without a python level call per sample
+                if key in self._drained and len(queue.pending) + queue.stored >= queue.maxlen:
+                    dropped = True
+                queue.append((timestamp, vector[0], vector[1], vector[2]))
+                previous = vectors.get(key)
+                vectors[key] = vector
+                data[key] = value
+                # do not notify callbacks on initialization,
+                # only if data has changed
+                if previous is not None and previous != vector:
+                    changed[key] = True
                 continue
 
-            # notify callbacks only if data has changed
-            if self._data[key] != value:
-                self._data[key] = value
-                self._notify_callbacks(key)
+            if key in self._drained and len(queue) == queue.maxlen:
+                dropped = True
+            queue.append((timestamp, value))
+            previous = data[key]
+            data[key] = value
+            if previous is not _NO_VALUE and previous != value:
+                changed[key] = True
+
+        if dropped:
+            self._stats['dropped'] += 1
+
+    # returns a copy of the packet counters
+    def get_stats(self):
+        return dict(self._stats)
 
     # checks if capability is available
     def has_capability(self, key):
-        return key in self._capabilities
+        return key in self._data
 
+    # _data is filled last, so a capability is only visible to other
+    # threads once all its containers exist
     def _add_capability(self, key):
         if not self.has_capability(key):
+            self._callbacks.setdefault(key, [])
+            if key in VECTOR_CAPABILITIES:
+                self._samples[key] = VectorQueue(self._queue_size)
+            else:
+                self._samples[key] = deque(maxlen=self._queue_size)
             self._capabilities.append(key)
-            self._callbacks[key] = []
-            self._data[key] = []
+            self._data[key] = _NO_VALUE
 
     # returns a list of all current capabilities
     def get_capabilities(self):
@@ -79,6 +601,39 @@ class Sensor():
             #raise KeyError(f'"{key}" is not a capability of this sensor.')
             return None
 
+    # remove and return all queued samples for specified capability
+    # as a list of (timestamp, value) tuples, oldest first
+    def drain_samples(self, key):
+        samples = self._drain(key)
+        if isinstance(samples, np.ndarray):
+            return [(t, {'x': x, 'y': y, 'z': z}) for t, x, y, z in samples.tolist()]
+        return samples
+
+    # same as drain_samples() for vector capabilities, but returns an
+    # n x 4 float array of (timestamp, x, y, z) rows
+    def drain_vectors(self, key):
+        samples = self._drain(key)
+        if isinstance(samples, list):
+            return np.zeros((0, 4))
+        return samples
+
+    # deque.popleft() is atomic and VectorQueue locks itself, so this is safe
+    # while the receive thread appends
+    def _drain(self, key):
+        samples = []
+        queue = self._samples.get(key)
+        if queue is None:
+            return samples
+        self._drained.add(key)
+        if isinstance(queue, VectorQueue):
+            return queue.drain()
+
+        while True:
+            try:
+                samples.append(queue.popleft())
+            except IndexError:
+                return samples
+
     # register a callback function for a change in specified capability
     def register_callback(self, key, func):
         self._add_capability(key)
@@ -86,126 +641,555 @@ class Sensor():
 
     # remove already registered callback function for specified capability
     def unregister_callback(self, key, func):
-        if key in self._callbacks:
+        if key in self._callbacks and func in self._callbacks[key]:
             self._callbacks[key].remove(func)
             return True
         else:
             # in case somebody wants to check if the callback was present before
             return False
 
+    # choose how callbacks are run, see InlineDispatcher, ExecutorDispatcher,
+    # CoalescingDispatcher and QtDispatcher in DIPPID_pyqtnode
+    # dispatchers can be shared between sensors and are not closed on disconnect
+    def set_dispatcher(self, dispatcher):
+        self._dispatcher = dispatcher if dispatcher is not None else _inline_dispatcher
+
     def _notify_callbacks(self, key):
-        for func in self._callbacks[key]:
-            func(self._data[key])
+        callbacks = self._callbacks[key]
+        if callbacks:
+            self._dispatcher.dispatch((self, key), tuple(callbacks), self._data[key])
 
 # sensor connected via WiFi/UDP
 # initialized with a UDP port
 # listens to all IPs by default
 # requires the socket module
+# the socket is non-blocking: each wakeup drains every pending datagram
+# and decodes them as one batch
+# each datagram may be a json or a binary frame
 class SensorUDP(Sensor):
-    def __init__(self, port, ip='0.0.0.0'):
+    # requested kernel receive buffer, absorbs bursts between two wakeups
+    RCVBUF_SIZE = 1 << 20
+    MAX_DATAGRAM_SIZE = 4096
+    # how long to wait for data before checking whether to stop receiving
+    POLL_TIMEOUT = 0.1
+
+    def __init__(self, port, ip='0.0.0.0', rcvbuf_size=RCVBUF_SIZE):
         Sensor.__init__(self)
         self._ip = ip
         self._port = port
+        self._rcvbuf_size = rcvbuf_size
         self._connect()
 
     def _connect(self):
         import socket
 
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvbuf_size)
+        except OSError:
+            # the OS may refuse or cap the size, the default still works
+            pass
         self._sock.bind((self._ip, self._port))
+        self._sock.setblocking(False)
         self._connection_thread = Thread(target=self._receive)
         self._connection_thread.start()
 
+    def disconnect(self):
+        Sensor.disconnect(self)
+        self._sock.close()
+
     def get_ip(self):
         print(self._ip)
 
     def _receive(self):
+        import select
+
         self._receiving = True
         while self._receiving:
-            data, addr = self._sock.recvfrom(1024)
+            readable, _, _ = select.select([self._sock], [], [], self.POLL_TIMEOUT)
+            if not readable:
+                continue
+
+            datagrams = self._drain_socket()
+            if datagrams:
+                self._handle_datagrams(datagrams)
+
+    # reads all datagrams currently queued in the socket without blocking
+    # and returns them as (data, addr) tuples
+    def _drain_socket(self):
+        datagrams = []
+        while True:
             try:
-                data_decoded = data.decode()
-            except UnicodeDecodeError:
+                datagrams.append(self._sock.recvfrom(self.MAX_DATAGRAM_SIZE))
+            except (BlockingIOError, InterruptedError):
+                return datagrams
+            except OSError:
+                # socket was closed while receiving
+                self._receiving = False
+                return datagrams
+
+    def _handle_datagrams(self, datagrams):
+        self._update_batch([data for data, addr in datagrams])
+
+# sensor connected via WiFi/UDP without a thread of its own
+# runs on an asyncio event loop, so many ports can share one loop (and one
+# thread); see AsyncioQtBridge in DIPPID_pyqtnode for running it inside Qt
+# like SensorUDP, each wakeup drains every pending datagram from the
+# non-blocking socket and decodes them as one batch
+# the socket is opened as soon as the loop runs; await connected() to wait for it
+class SensorAsyncUDP(Sensor):
+    RCVBUF_SIZE = SensorUDP.RCVBUF_SIZE
+    MAX_DATAGRAM_SIZE = SensorUDP.MAX_DATAGRAM_SIZE
+
+    def __init__(self, port, ip='0.0.0.0', loop=None, rcvbuf_size=RCVBUF_SIZE):
+        Sensor.__init__(self)
+        self._ip = ip
+        self._port = port
+        self._rcvbuf_size = rcvbuf_size
+        self._sock = None
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        self._connecting = asyncio.ensure_future(self._connect(), loop=self._loop)
+
+    async def _connect(self):
+        import socket
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvbuf_size)
+        except OSError:
+            pass
+        try:
+            sock.bind((self._ip, self._port))
+        except OSError:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self._sock = sock
+        self._receiving = True
+        # a datagram transport would read a single datagram per wakeup
+        self._loop.add_reader(sock, self._on_readable)
+
+    # returns an awaitable that finishes once the socket is bound
+    # (or raises the OSError that prevented binding it)
+    def connected(self):
+        return self._connecting
+
+    _drain_socket = SensorUDP._drain_socket
+
+    def _on_readable(self):
+        datagrams = self._drain_socket()
+        if datagrams:
+            self._update_batch([data for data, addr in datagrams])
+
+    def disconnect(self):
+        self._receiving = False
+        Sensor.instances.remove(self)
+        if self._sock is not None:
+            # does nothing if the loop is already closed
+            self._loop.remove_reader(self._sock)
+            self._sock.close()
+        else:
+            self._connecting.cancel()
+        self.stop_recording()
+
+    def get_ip(self):
+        print(self._ip)
+
+# one of the devices received by a SensorHub
+# behaves like any other sensor, but has no connection of its own
+# record() logs the datagrams of this device only; the hub writes them
+class HubDevice(Sensor):
+    # length of the window over which the packet rate is measured (seconds)
+    RATE_WINDOW = 1.0
+
+    def __init__(self, device_id, addr):
+        Sensor.__init__(self)
+        self.device_id = device_id
+        # address the last packet came from
+        self.addr = addr
+        self._rate = 0.0
+        self._rate_count = 0
+        self._rate_start = monotonic()
+        self._last_packet = self._rate_start
+
+    def _update_decoded(self, items):
+        Sensor._update_decoded(self, items)
+
+        now = monotonic()
+        self._last_packet = now
+        self._rate_count += len(items)
+        if now - self._rate_start >= self.RATE_WINDOW:
+            self._rate = self._rate_count / (now - self._rate_start)
+            self._rate_count = 0
+            self._rate_start = now
+
+    # packets per second, 0 once the device stopped sending
+    def get_rate(self):
+        if monotonic() - self._last_packet > 2 * self.RATE_WINDOW:
+            return 0.0
+        return self._rate
+
+    def disconnect(self):
+        self._receiving = False
+        if self in Sensor.instances:
+            Sensor.instances.remove(self)
+        self.stop_recording()
+
+# receives DIPPID data of many devices on a single UDP port
+# packets are demultiplexed into one HubDevice per sender, which is
+# created on first contact
+# devices are identified by the sender address ("ip:port") or, if id_key
+# is given and the packet contains that key, by its value
+class SensorHub(SensorUDP):
+    def __init__(self, port, ip='0.0.0.0', id_key=None, rcvbuf_size=SensorUDP.RCVBUF_SIZE):
+        self._id_key = id_key
+        self._devices = {}
+        # functions called with (device_id, device) for every new device
+        self._device_callbacks = []
+        SensorUDP.__init__(self, port, ip, rcvbuf_size)
+
+    def disconnect(self):
+        SensorUDP.disconnect(self)
+        for device in list(self._devices.values()):
+            device.disconnect()
+
+    # returns the ids of all devices seen so far, in order of first contact
+    def get_devices(self):
+        return list(self._devices)
+
+    # returns the sensor of a device or None if it never sent anything
+    def get_device(self, device_id):
+        return self._devices.get(device_id)
+
+    # returns the current packet rate of every device
+    def get_rates(self):
+        return {device_id: device.get_rate() for device_id, device in list(self._devices.items())}
+
+    # register a function that is called with (device_id, device) on first contact
+    # note: it runs on the receive thread
+    def register_device_callback(self, func):
+        self._device_callbacks.append(func)
+
+    def _handle_datagrams(self, datagrams):
+        recorder = self._recorder
+        if recorder is not None:
+            recorder.write([data for data, addr in datagrams])
+
+        batches = {}
+        # raw datagrams of every device, for devices that are recording
+        frames = {}
+        for data, addr in datagrams:
+            data_json = self._decode(data)
+            if data_json is None:
                 continue
-            self._update(data_decoded)
+
+            device_id = None
+            if self._id_key is not None:
+                device_id = data_json.pop(self._id_key, None)
+            if device_id is None:
+                device_id = f'{addr[0]}:{addr[1]}'
+            device = self._get_or_create_device(str(device_id), addr)
+            device.addr = addr
+            batches.setdefault(device, []).append((monotonic(), data_json))
+            frames.setdefault(device, []).append(data)
+
+        for device, items in batches.items():
+            device_recorder = device._recorder
+            if device_recorder is not None:
+                device_recorder.write(frames[device])
+            device._update_decoded(items)
+
+    def _get_or_create_device(self, device_id, addr):
+        device = self._devices.get(device_id)
+        if device is None:
+            device = HubDevice(device_id, addr)
+            self._devices[device_id] = device
+            for func in self._device_callbacks:
+                func(device_id, device)
+        return device
+
+# replays a log written by Sensor.record() (see SensorRecorder)
+# speed 1 replays in real time, 2 twice as fast and 0 as fast as possible
+# samples are stamped with the time they are due at the chosen speed; at
+# speed 0 they keep the spacing they were recorded with
+# with target set to an (ip, port) tuple the frames are not decoded but
+# re-emitted as UDP datagrams, e.g. to a SensorUDP in another process
+# with repeat set the log is replayed until disconnect() is called
+class SensorReplay(Sensor):
+    # frames decoded or sent at once when replaying as fast as possible
+    BATCH_SIZE = 64
+    # longest sleep before checking whether to stop replaying
+    POLL_TIMEOUT = 0.1
+
+    def __init__(self, path, speed=1.0, target=None, repeat=False):
+        # read the header now, so a wrong path fails here and not in the thread
+        next(read_log(path), None)
+        Sensor.__init__(self)
+        self._path = path
+        self._speed = speed
+        self._target = target
+        self._repeat = repeat
+        self._sock = None
+        self._connect()
+
+    def _connect(self):
+        if self._target is not None:
+            import socket
+
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._receiving = True
+        self._connection_thread = Thread(target=self._receive)
+        self._connection_thread.start()
+
+    def disconnect(self):
+        Sensor.disconnect(self)
+        if self._sock is not None:
+            self._sock.close()
+
+    # True once the whole log was replayed
+    def is_finished(self):
+        return not self._connection_thread.is_alive()
+
+    # waits until the whole log was replayed, returns False on timeout
+    def wait(self, timeout=None):
+        self._connection_thread.join(timeout)
+        return self.is_finished()
+
+    def _receive(self):
+        while self._receiving:
+            self._replay()
+            if not self._repeat:
+                break
+        self._receiving = False
+
+    def _replay(self):
+        start = monotonic()
+        frames = []
+        timestamps = []
+        for offset, frame in read_log(self._path):
+            if not self._receiving:
+                return
+            if self._speed:
+                due = start + offset / self._speed
+                if due > monotonic():
+                    self._emit(frames, timestamps)
+                    frames, timestamps = [], []
+                    self._sleep_until(due)
+            else:
+                due = start + offset
+            frames.append(frame)
+            timestamps.append(due)
+            if len(frames) >= self.BATCH_SIZE:
+                self._emit(frames, timestamps)
+                frames, timestamps = [], []
+        self._emit(frames, timestamps)
+
+    def _sleep_until(self, due):
+        while self._receiving:
+            remaining = due - monotonic()
+            if remaining <= 0:
+                return
+            sleep(min(remaining, self.POLL_TIMEOUT))
+
+    def _emit(self, frames, timestamps):
+        if not frames:
+            return
+        if self._sock is None:
+            self._update_batch(frames, timestamps)
+            return
+        for frame in frames:
+            try:
+                self._sock.sendto(frame, self._target)
+            except OSError:
+                # e.g. the kernel buffer is full, drop the frame like the network would
+                self._stats['dropped'] += 1
 
 # sensor connected via serial connection (USB)
 # initialized with a path to a TTY (e.g. /dev/ttyUSB0)
 # default baudrate is 115200
+# accepts newline terminated json frames and binary frames
 # requires pyserial
+# a single thread reads everything waiting in the input buffer at once,
+# splits it into frames and decodes them as one batch
+# if the connection is lost, the same thread reconnects with exponential
+# backoff (RECONNECT_MIN_DELAY doubling up to RECONNECT_MAX_DELAY seconds)
+# until it succeeds or disconnect() is called
 class SensorSerial(Sensor):
+    # how long a read waits for data before checking whether to stop receiving
+    POLL_TIMEOUT = 0.1
+    RECONNECT_MIN_DELAY = 0.1
+    RECONNECT_MAX_DELAY = 5.0
+    # longer lines are discarded as malformed
+    MAX_FRAME_SIZE = 4096
+
     def __init__(self, tty, baudrate=115200):
         Sensor.__init__(self)
         self._tty = tty
         self._baudrate = baudrate
+        self._serial = None
+        self._buffer = bytearray()
+        self._stats['reconnects'] = 0
+        # the first connection fails right away, later ones are retried
+        self._open()
         self._connect()
 
-    def _connect(self):
+    def _open(self):
         import serial
 
-        self._serial = serial.Serial(self._tty)
-        self._serial.baudrate = self._baudrate
+        self._serial = serial.Serial(self._tty, self._baudrate, timeout=self.POLL_TIMEOUT)
+        self._buffer.clear()
+
+    def _close(self):
+        if self._serial is not None:
+            try:
+                self._serial.close()
+            except OSError:
+                pass
+            self._serial = None
+
+    def _connect(self):
+        self._receiving = True
         self._connection_thread = Thread(target=self._receive)
         self._connection_thread.start()
 
+    def disconnect(self):
+        Sensor.disconnect(self)
+        self._close()
+
     def _receive(self):
-        self._receiving = True
-        try:
-            while self._receiving:
-                data = self._serial.readline()
+        delay = self.RECONNECT_MIN_DELAY
+        while self._receiving:
+            if self._serial is None:
+                try:
+                    self._open()
+                    self._stats['reconnects'] += 1
+                    delay = self.RECONNECT_MIN_DELAY
+                except (OSError, ValueError):
+                    # OSError includes serial.SerialException
+                    self._wait(delay)
+                    delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+                    continue
+
+            try:
+                data = self._serial.read(max(1, self._serial.in_waiting))
+            except (OSError, TypeError, AttributeError):
+                # connection lost; pyserial may raise TypeError or AttributeError
+                # when the port disappears while reading
+                self._close()
+                continue
+            if not data:
+                continue
+
+            self._buffer += data
+            frames = self._split_frames()
+            if frames:
+                self._update_batch(frames)
+
+    # sleeps for the given time, but returns early on disconnect()
+    def _wait(self, delay):
+        end = monotonic() + delay
+        while self._receiving and monotonic() < end:
+            sleep(min(self.POLL_TIMEOUT, end - monotonic()))
+
+    # removes all complete frames from the receive buffer and returns them:
+    # binary frames if they start with the magic byte, newline terminated
+    # json frames otherwise; incomplete frames stay in the buffer
+    def _split_frames(self):
+        buffer = self._buffer
+        frames = []
+        start = 0
+        end = len(buffer)
+        while start < end:
+            if buffer[start] == BINARY_MAGIC[0]:
+                if end - start < _BINARY_HEADER.size:
+                    break
                 try:
-                    data_decoded = data.decode()
-                except UnicodeDecodeError:
+                    size = binary_frame_size(buffer[start:start + _BINARY_HEADER.size])
+                except ValueError:
+                    # not a valid frame, read it as a line
+                    size = None
+                if size is not None:
+                    if end - start < size:
+                        break
+                    frames.append(bytes(buffer[start:start + size]))
+                    start += size
                     continue
-                self._update(data)
-        except:
-            # connection lost, try again
-            self._connect()
+
+            newline = buffer.find(b'\n', start)
+            if newline < 0:
+                if end - start > self.MAX_FRAME_SIZE:
+                    # garbage without line breaks
+                    self._stats['malformed'] += 1
+                    start = end
+                break
+            line = bytes(buffer[start:newline]).strip()
+            if line:
+                frames.append(line)
+            start = newline + 1
+        del buffer[:start]
+        return frames
 
 # uses a Nintendo Wiimote as a sensor (connected via Bluetooth)
 # initialized with a Bluetooth address
 # requires wiimote.py (https://github.com/RaphaelWimmer/wiimote.py)
 # and pybluez
+# polls the wiimote `rate` times per second on a fixed schedule: a late poll
+# does not shift the following ones, after a long stall the schedule restarts
+# every poll reads accelerometer and buttons as one snapshot and stores them
+# as one frame; buttons are only included when one of them changed
 class SensorWiimote(Sensor):
-    def __init__(self, btaddr):
+    POLL_RATE = 100
+
+    def __init__(self, btaddr, rate=POLL_RATE):
         Sensor.__init__(self)
         self._btaddr = btaddr
+        self._rate = rate
         self._connect()
 
     def _connect(self):
         import wiimote
 
         self._wiimote = wiimote.connect(self._btaddr)
+        self._receiving = True
         self._connection_thread = Thread(target=self._receive)
         self._connection_thread.start()
 
+    # accelerometer values and the state of all buttons as a bitmask
+    # (bit i = i-th button of buttons)
+    def _snapshot(self, buttons):
+        accelerometer = self._wiimote.accelerometer
+        state = self._wiimote.buttons
+        vector = {'x': accelerometer[0], 'y': accelerometer[1], 'z': accelerometer[2]}
+        mask = 0
+        for i, button in enumerate(buttons):
+            if state[button]:
+                mask |= 1 << i
+        return vector, mask
+
     def _receive(self):
-        self._receiving = True
-        buttons = self._wiimote.buttons.BUTTONS.keys()
+        buttons = list(self._wiimote.buttons.BUTTONS.keys())
+        keys = ['button_' + button.lower() for button in buttons]
+        period = 1 / self._rate
+        previous_mask = None
+        next_poll = monotonic()
         while self._receiving:
-            x = self._wiimote.accelerometer[0]
-            y = self._wiimote.accelerometer[1]
-            z = self._wiimote.accelerometer[2]
-            data_string = f'{{"x":{x},"y":{y},"z":{z}}}'
-            self._update('accelerometer', data_string)
-
-            for button in buttons:
-                state = int(self._wiimote.buttons[button])
-                self._update(f'button_' + button.lower(), state)
-            sleep(0.001)
-
-    def _update(self, key, value):
-        self._add_capability(key)
-        
-        # do not notify callbacks on initialization
-        if self._data[key] == []:
-            self._data[key] = value
-            return
+            vector, mask = self._snapshot(buttons)
+            frame = {'accelerometer': vector}
+            if mask != previous_mask:
+                changed = mask if previous_mask is None else mask ^ previous_mask
+                for i, key in enumerate(keys):
+                    if changed >> i & 1 or previous_mask is None:
+                        frame[key] = mask >> i & 1
+                previous_mask = mask
+            now = monotonic()
+            self._update_decoded(((now, frame),))
 
-        # notify callbacks only if data has changed
-        if self._data[key] != value:
-            self._data[key] = value
-            self._notify_callbacks(key)
+            next_poll += period
+            if next_poll < now - period:
+                # stalled for more than one period, skip the missed polls
+                next_poll = now + period
+            if next_poll > now:
+                sleep(next_poll - now)
 
 # close the program softly when ctrl+c is pressed
 def handle_interrupt_signal(signal, frame):
@@ -2,6 +2,7 @@
 # coding: utf-8
 # -*- coding: utf-8 -*-
 import time
+import asyncio
 
 from pyqtgraph.flowchart import Flowchart, Node
 from pyqtgraph.flowchart.library.common import CtrlNode
@@ -9,7 +10,9 @@ import pyqtgraph.flowchart.library as fclib
 from pyqtgraph.Qt import QtGui, QtCore
 import pyqtgraph as pg
 import numpy as np
-from DIPPID import SensorUDP
+from DIPPID import SensorUDP, SensorAsyncUDP, SensorHub, CoalescingDispatcher
+from pipeline import BufferStage, MotionGate
+from shared_ring import SensorProcess
 import sys
 
 
@@ -17,6 +20,12 @@ class BufferNode(Node):
     """
     Buffers the last n samples provided on input and provides them as a list of
     length n on output.
+    Input may be a single value, a 1-D array of samples or an N x C array of
+    multi-channel samples. Single channel buffers output a 1-D array, multi
+    channel buffers an n x C array. The output is a read-only view into a
+    preallocated ring buffer and is only valid until the next input arrives.
+    Until n samples arrived the output is None, so downstream nodes only see
+    full windows.
     A spinbox widget allows for setting the size of the buffer.
     Default size is 32 samples.
     """
@@ -29,17 +38,167 @@ class BufferNode(Node):
         }
 
         self.buffer_size = 32
-        self._buffer = np.array([])
+        self.stage = BufferStage(self.buffer_size)
+
+        self._init_ui()
         Node.__init__(self, name, terminals=terminals)
 
-    def process(self, **kwds):
-        self._buffer = np.append(self._buffer, kwds['dataIn'])[-self.buffer_size:]
+    def _init_ui(self):
+        self.ui = QtGui.QWidget()
+        self.layout = QtGui.QGridLayout()
 
-        return {'dataOut': self._buffer}
+        label = QtGui.QLabel("Buffer size:")
+        self.layout.addWidget(label)
+
+        self.size_input = QtGui.QSpinBox()
+        self.size_input.setMinimum(1)
+        self.size_input.setMaximum(4096)
+        self.size_input.setValue(self.buffer_size)
+        self.size_input.valueChanged.connect(self.set_buffer_size)
+        self.layout.addWidget(self.size_input)
+        self.ui.setLayout(self.layout)
+
+    def ctrlWidget(self):
+        return self.ui
+
+    def set_buffer_size(self, size):
+        self.buffer_size = size
+        self.stage.set_size(size)
+
+    def process(self, **kwds):
+        return {'dataOut': self.stage.process(kwds['dataIn'])}
 
 fclib.registerNodeType(BufferNode, [('Data',)])
 
 
+class MotionGateNode(Node):
+    """
+    Passes its input on only while the device is moving.
+    The motion energy is the summed per-axis variance of the input, usually
+    the window of a (multi-channel) BufferNode. The gate opens when the energy
+    exceeds the threshold and closes again after it stayed below half the
+    threshold for a number of updates (hold), so short pauses within a
+    gesture do not split it.
+    While closed, dataOut is None: downstream nodes skip their work, and the
+    SvmNode uses the end of a motion to end an auto-segmented recording.
+    active outputs whether the gate is open. A threshold of 0 always passes.
+    """
+    nodeName = "MotionGate"
+
+    def __init__(self, name):
+        terminals = {
+            'dataIn': dict(io='in'),
+            'dataOut': dict(io='out'),
+            'active': dict(io='out'),
+        }
+
+        self.gate = MotionGate()
+        self.active = False
+
+        self._init_ui()
+        Node.__init__(self, name, terminals=terminals)
+
+    def _init_ui(self):
+        self.ui = QtGui.QWidget()
+        self.layout = QtGui.QGridLayout()
+
+        self.layout.addWidget(QtGui.QLabel("Threshold (variance):"))
+        self.threshold_input = QtGui.QDoubleSpinBox()
+        self.threshold_input.setDecimals(4)
+        self.threshold_input.setSingleStep(0.005)
+        self.threshold_input.setMaximum(100)
+        self.threshold_input.setValue(self.gate.threshold)
+        self.threshold_input.valueChanged.connect(self.set_threshold)
+        self.layout.addWidget(self.threshold_input)
+
+        self.layout.addWidget(QtGui.QLabel("Hold (updates):"))
+        self.hold_input = QtGui.QSpinBox()
+        self.hold_input.setMaximum(1000)
+        self.hold_input.setValue(self.gate.hold)
+        self.hold_input.valueChanged.connect(self.set_hold)
+        self.layout.addWidget(self.hold_input)
+
+        self.state_label = QtGui.QLabel("idle")
+        self.layout.addWidget(self.state_label)
+        self.ui.setLayout(self.layout)
+
+    def ctrlWidget(self):
+        return self.ui
+
+    def set_threshold(self, threshold):
+        self.gate.threshold = threshold
+
+    def set_hold(self, hold):
+        self.gate.hold = hold
+
+    def process(self, **kwds):
+        data = self.gate.process(kwds['dataIn'])
+        if self.gate.active != self.active:
+            self.active = self.gate.active
+            self.state_label.setText("moving" if self.active else "idle")
+        return {'dataOut': data, 'active': self.active}
+
+fclib.registerNodeType(MotionGateNode, [('Data',)])
+
+
+class AsyncioQtBridge:
+    """
+    Runs an asyncio event loop inside the Qt event loop, so asyncio based
+    sensors (SensorAsyncUDP) work in a Qt application without extra threads.
+    A QTimer steps the asyncio loop every few milliseconds: each step runs
+    all ready callbacks and polls the sockets without blocking.
+    The loop is a selector loop on every platform: SensorAsyncUDP watches its
+    socket with add_reader(), which the default proactor loop on Windows does
+    not support.
+    """
+
+    def __init__(self, loop=None, interval=5):
+        self.loop = loop if loop is not None else asyncio.SelectorEventLoop()
+        asyncio.set_event_loop(self.loop)
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self._step)
+        self.timer.start(interval)
+
+    def _step(self):
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def stop(self):
+        self.timer.stop()
+        self.loop.close()
+
+
+class QtDispatcher(QtCore.QObject):
+    """
+    Callback dispatcher for DIPPID sensors that runs callbacks on the thread
+    of the Qt event loop (the GUI thread), so they may safely touch widgets
+    and flowcharts.
+    By default updates are coalesced: at most one update per capability is
+    waiting in the Qt event queue and it always carries the newest value.
+    Must be created on the GUI thread.
+    """
+    _scheduled = QtCore.Signal(object)
+
+    def __init__(self, coalesce=True):
+        QtCore.QObject.__init__(self)
+        # queued across threads, so the slot runs on this object's thread
+        self._scheduled.connect(self._run, QtCore.Qt.QueuedConnection)
+        self._coalescer = CoalescingDispatcher(schedule=self._scheduled.emit) if coalesce else None
+
+    def dispatch(self, key, callbacks, value):
+        if self._coalescer is not None:
+            self._coalescer.dispatch(key, callbacks, value)
+        else:
+            self._scheduled.emit(lambda: [func(value) for func in callbacks])
+
+    def _run(self, func):
+        func()
+
+    def close(self):
+        pass
+
+
 class DIPPIDNode(Node):
     """
     Outputs sensor data from DIPPID supported hardware.
@@ -48,26 +207,53 @@ class DIPPIDNode(Node):
     Pressing the "connect" button tries connecting to the DIPPID device.
     Update rate can be changed via a spinbox widget. Setting it to "0"
     activates callbacks every time a new sensor value arrives (which is
-    quite often -> performance hit)
+    quite often -> performance hit). These callbacks are delivered on the GUI
+    thread through a QtDispatcher, at most one pending update at a time.
+    If an asyncio event loop is set via set_event_loop() (e.g. the one of an
+    AsyncioQtBridge), the sensor runs on that loop instead of its own thread.
+    With "multi-device hub" checked, the port is opened as a SensorHub that
+    receives many devices at once; the device to output is selected from a
+    list that also shows its packet rate. A hub can be shared between several
+    nodes via set_hub().
+    Every sample received since the last update is emitted as one block:
+    accelX/accelY/accelZ carry arrays of length N and timestamps carries the
+    N receive times, so no samples are lost at low update rates.
+    accel carries the same block as one N x 3 array; feeding it into a single
+    multi-channel BufferNode evaluates the downstream chain once per update
+    instead of once per axis buffer.
+    With "separate process" checked, packets are received and decoded by a
+    SensorProcess and read from shared memory without copying, so receiving
+    keeps up while the GUI thread is busy. Callbacks do not cross processes:
+    an update rate of 0 polls the shared memory every millisecond.
     """
 
     nodeName = "DIPPID"
 
     def __init__(self, name):
         terminals = {
+            'accel': dict(io='out'),
             'accelX': dict(io='out'),
             'accelY': dict(io='out'),
             'accelZ': dict(io='out'),
+            'timestamps': dict(io='out'),
         }
 
         self.dippid = None
-        self._acc_vals = []
+        self.hub = None
+        self._dispatcher = QtDispatcher()
+        self._loop = None
+        self._acc_block = np.zeros((0, 3))
+        self._timestamps = np.zeros(0)
 
         self._init_ui()
 
         self.update_timer = QtCore.QTimer()
         self.update_timer.timeout.connect(self.update_all_sensors)
 
+        # refreshes the device list and rates in hub mode
+        self.device_timer = QtCore.QTimer()
+        self.device_timer.timeout.connect(self.refresh_devices)
+
         Node.__init__(self, name, terminals=terminals)
 
     def _init_ui(self):
@@ -92,6 +278,21 @@ class DIPPIDNode(Node):
         self.update_rate_input.valueChanged.connect(self.set_update_rate)
         self.layout.addWidget(self.update_rate_input)
 
+        self.hub_checkbox = QtGui.QCheckBox("multi-device hub")
+        self.layout.addWidget(self.hub_checkbox)
+
+        self.process_checkbox = QtGui.QCheckBox("separate process")
+        self.layout.addWidget(self.process_checkbox)
+
+        self.device_select = QtGui.QComboBox()
+        self.device_select.currentTextChanged.connect(self.select_device)
+        self.device_select.setVisible(False)
+        self.layout.addWidget(self.device_select)
+
+        self.device_rate_label = QtGui.QLabel()
+        self.device_rate_label.setVisible(False)
+        self.layout.addWidget(self.device_rate_label)
+
         self.connect_button = QtGui.QPushButton("connect")
         self.connect_button.clicked.connect(self.connect_device)
         self.layout.addWidget(self.connect_button)
@@ -101,17 +302,21 @@ class DIPPIDNode(Node):
         if self.dippid is None or not self.dippid.has_capability('accelerometer'):
             return
 
-        v = self.dippid.get_value('accelerometer')
-        self._acc_vals = [v['x'], v['y'], v['z']]
+        if isinstance(self.dippid, SensorProcess):
+            # view into shared memory, consumed by the chain before it is overwritten
+            block = self.dippid.drain_block()
+        else:
+            block = self.dippid.drain_vectors('accelerometer')
+        if len(block) == 0:
+            return
+
+        self._timestamps = block[:, 0]
+        self._acc_block = block[:, 1:]
 
         self.update()
 
     def update_accel(self, acc_vals):
-        if not self.dippid.has_capability('accelerometer'):
-            return
-
-        self._acc_vals = [acc_vals['x'], acc_vals['y'], acc_vals['z']]
-        self.update()
+        self.update_all_sensors()
 
     def ctrlWidget(self):
         return self.ui
@@ -121,7 +326,21 @@ class DIPPIDNode(Node):
             return
 
         self.connect_button.setText("connecting...")
-        self.dippid = SensorUDP(int(self.text.text().strip()))
+        if self.hub_checkbox.isChecked():
+            self._connect_hub()
+            return
+
+        try:
+            port = int(self.text.text().strip())
+            if self.process_checkbox.isChecked():
+                self.dippid = SensorProcess(port)
+            elif self._loop is not None:
+                self.dippid = SensorAsyncUDP(port, loop=self._loop)
+                self.dippid.connected().add_done_callback(self._on_async_connected)
+            else:
+                self.dippid = SensorUDP(port)
+        except (ValueError, OSError):
+            self.dippid = None
 
         if self.dippid is None:
             self.connect_button.setText("try again")
@@ -130,17 +349,86 @@ class DIPPIDNode(Node):
         self.connect_button.setText("connected")
         self.set_update_rate(self.update_rate_input.value())
         self.connect_button.setEnabled(False)
+        self.process_checkbox.setEnabled(False)
+
+    def _connect_hub(self):
+        if self.hub is None:
+            try:
+                self.hub = SensorHub(int(self.text.text().strip()))
+            except (ValueError, OSError):
+                self.connect_button.setText("try again")
+                return
+
+        self.connect_button.setText("connected")
+        self.connect_button.setEnabled(False)
+        self.hub_checkbox.setEnabled(False)
+        self.device_select.setVisible(True)
+        self.device_rate_label.setVisible(True)
+        self.refresh_devices()
+        self.device_timer.start(1000)
+
+    # use a hub that is shared with other nodes instead of opening a port
+    def set_hub(self, hub):
+        self.hub = hub
+        self.hub_checkbox.setChecked(hub is not None)
+
+    # adds devices that appeared since the last refresh and shows the rate
+    # of the selected one
+    def refresh_devices(self):
+        if self.hub is None:
+            return
+
+        known = {self.device_select.itemText(i) for i in range(self.device_select.count())}
+        for device_id in self.hub.get_devices():
+            if device_id not in known:
+                self.device_select.addItem(device_id)
+
+        device_id = self.device_select.currentText()
+        if device_id:
+            self.device_rate_label.setText(f"{self.hub.get_rates().get(device_id, 0.0):.1f} packets/s")
+
+    def select_device(self, device_id):
+        if self.hub is None or not device_id:
+            return
+
+        if self.dippid is not None:
+            self.dippid.unregister_callback('accelerometer', self.update_accel)
+        self.dippid = self.hub.get_device(device_id)
+        # drop what the device sent before it was selected
+        self.dippid.drain_samples('accelerometer')
+        self.set_update_rate(self.update_rate_input.value())
+
+    # the async sensor binds its socket later, on the event loop
+    def _on_async_connected(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+
+        self.dippid.disconnect()
+        self.dippid = None
+        self.update_timer.stop()
+        self.connect_button.setText("try again")
+        self.connect_button.setEnabled(True)
+
+    # run sensors on the given asyncio event loop instead of a thread each
+    def set_event_loop(self, loop):
+        self._loop = loop
 
     def set_update_rate(self, rate):
         if self.dippid is None:
             return
 
+        if isinstance(self.dippid, SensorProcess):
+            self.update_timer.start(int(1000 / rate) if rate else 1)
+            return
+
         self.dippid.unregister_callback('accelerometer', self.update_accel)
 
         if rate == 0:
             self.update_timer.stop()
+            self.dippid.set_dispatcher(self._dispatcher)
+            self.dippid.register_callback('accelerometer', self.update_accel)
         else:
-            self.update_timer.start(1000 / rate)
+            self.update_timer.start(int(1000 / rate))
 
     def callback(self):
         time.sleep(10)
@@ -151,7 +439,8 @@ class DIPPIDNode(Node):
         return self.dippid
 
     def process(self, **kwdargs):
-        return {'accelX': np.array([self._acc_vals[0]]), 'accelY': np.array([self._acc_vals[1]]), 'accelZ': np.array([self._acc_vals[2]])}
+        return {'accel': self._acc_block, 'accelX': self._acc_block[:, 0], 'accelY': self._acc_block[:, 1], 'accelZ': self._acc_block[:, 2],
+                'timestamps': self._timestamps}
 
 fclib.registerNodeType(DIPPIDNode, [('Sensor',)])
 
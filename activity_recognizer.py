@@ -1,10 +1,10 @@
 import sys
 from enum import Enum
+from threading import Thread
 import pyqtgraph as pg
 import numpy as np
 
 from scipy.fft import fft
-from sklearn import svm
 
 from PyQt5 import QtWidgets
 from pyqtgraph.Qt import QtGui, QtCore
@@ -12,7 +12,10 @@ from pyqtgraph.flowchart import Flowchart, Node
 import pyqtgraph.flowchart.library as fclib
 
 from DIPPID import SensorUDP, SensorSerial, SensorWiimote
-from DIPPID_pyqtnode import BufferNode, DIPPIDNode
+from DIPPID_pyqtnode import BufferNode, DIPPIDNode, MotionGateNode, AsyncioQtBridge
+from gesture_store import GestureStore
+from pipeline import SpectrumStage, GestureRecognizer, GestureTuner, FEATURE_FAMILIES, extract_features
+from node_profiler import ProfilerPanel
 
 # workload distributed equally
 # auth: eric blank & joshua benker
@@ -52,7 +55,8 @@ class DisplayTextNode(Node):
     # sets the text to current prediction
     def process(self, **kargs):
         prediction = kargs['dataIn']
-        self.text.setText(prediction)
+        if prediction != self.text.text():
+            self.text.setText(prediction)
 
 fclib.registerNodeType(DisplayTextNode, [('display',)])
 
@@ -62,6 +66,17 @@ fclib.registerNodeType(DisplayTextNode, [('display',)])
 # such as a list of frequency components) and trains a SVM classifier with this data (and previous data).
 # The category for this sample can be defined by a text field in the control pane.
 # In prediction mode the SvmNode can read in a sample and output the predicted category as a string
+# training only happens when the recorded data changed and runs on a background thread;
+# the previous model keeps predicting until the new one is swapped in
+# alternatively an incremental classifier learns every recorded sample immediately
+# predictions are scheduled and smoothed by a PredictionScheduler; the number of new samples is
+# taken from the samples input (e.g. the timestamps of the DIPPIDNode), without it every update
+# counts as one sample. the prediction output only changes when the predicted label changes
+# no input (None, e.g. from an idle MotionGateNode) is neither recorded nor predicted. with
+# "auto segment" checked, a recording stops by itself when the motion of the gesture ends
+# recorded samples are kept in an append-only RecordingStore; with a GestureStore set, it is
+# memory-mapped from disk and gestures and models are restored on the next start
+# the recording, training and prediction logic is a GestureRecognizer (see pipeline.py), the node adds the ui
 class SvmNode(Node):
     nodeName = 'svm'
 
@@ -72,22 +87,50 @@ class SvmNode(Node):
     TRAINING_TEXT = "select an activtiy in the list and record performing the gesture" \
                     " by pressing the record button"
 
-    state = GestureNodeState.INACTIVE
-    gestures_dict = {}
-    gesture_id = 0
+    # emitted from the training thread with the fitted model (or None) and its dataset version
+    sigModelTrained = QtCore.Signal(object, int)
+    # emitted from the tuning thread with the tasks done, all tasks and the best parameters
+    # and accuracy so far
+    sigTuneProgress = QtCore.Signal(int, int, object, float)
+    # emitted from the tuning thread with (model, params, accuracy) or None, the dataset
+    # version and why there is no result
+    sigModelTuned = QtCore.Signal(object, int, str)
 
     def __init__(self, name):
         Node.__init__(self, name, terminals={
             'dataIn': {'io': 'in'},
+            'samples': {'io': 'in'},
             'prediction': {'io': 'out'},
             })
+        self.state = GestureNodeState.INACTIVE
+        # recordings, models and prediction scheduling
+        self.recognizer = GestureRecognizer()
+        self.gesture_id = 0
         self.prediction = ''
         self.saved_gestures = []
         self.is_recording = False
-        # svm
-        self.svc = svm.SVC()
+        # stop recording when the motion ends, see handle_gesture_training()
+        self.auto_segment = False
+        self.segment_recorded = False
+        self.sigModelTrained.connect(self.on_model_trained)
+        # the running GestureTuner, see on_tune_button_clicked()
+        self.tuner = None
+        self.sigTuneProgress.connect(self.on_tune_progress)
+        self.sigModelTuned.connect(self.on_model_tuned)
         self.init_ui()
 
+    # restores gestures and model from the store and saves them there from now on
+    def set_store(self, store):
+        self.recognizer.set_store(store)
+        self.saved_gestures = self.recognizer.gestures()
+        self.gesture_select.clear()
+        self.gesture_select.addItems(self.saved_gestures)
+
+        self.classifier_select.blockSignals(True)
+        self.classifier_select.setCurrentText(self.recognizer.classifier)
+        self.classifier_select.blockSignals(False)
+        self.update_model_label()
+
     # initilize user interface
     def init_ui(self):
         self.ui = QtGui.QWidget()
@@ -108,6 +151,14 @@ class SvmNode(Node):
         self.gesture_name = QtGui.QLineEdit()
         self.gesture_name.setVisible(False)
         self.mode_layout.addWidget(self.gesture_name, 7, 0, 2, 2)
+        self.model_label = QtGui.QLabel()
+        self.mode_layout.addWidget(self.model_label, 9, 0, 1, 3)
+        self.classifier_select = QtWidgets.QComboBox()
+        self.classifier_select.addItems(["svm", "incremental"])
+        self.classifier_select.currentTextChanged.connect(self.on_classifier_changed)
+        self.mode_layout.addWidget(QtGui.QLabel("classifier:"), 10, 0)
+        self.mode_layout.addWidget(self.classifier_select, 10, 1)
+        self.update_model_label()
 
         self.init_training_ui()
         self.init_prediction_ui()
@@ -161,14 +212,29 @@ class SvmNode(Node):
         self.gesture_layout.addWidget(self.delete_button, 9, 2)
         self.gesture_layout.addWidget(self.record_button, 10, 1)
         self.gesture_layout.addWidget(self.stop_record_button, 10, 2)
+        self.auto_segment_checkbox = QtGui.QCheckBox("auto segment (stop when the motion ends)")
+        self.auto_segment_checkbox.toggled.connect(self.set_auto_segment)
+        self.gesture_layout.addWidget(self.auto_segment_checkbox, 11, 1, 1, 2)
         self.record_button.hide()
         self.stop_record_button.hide()
+        self.auto_segment_checkbox.hide()
+
+        # cross-validated search for the best svm parameters, see on_tune_button_clicked()
+        self.tune_button = QtGui.QPushButton("tune svm")
+        self.tune_progress = QtGui.QProgressBar()
+        self.tune_label = QtGui.QLabel()
+        self.tune_label.setWordWrap(True)
+        self.gesture_layout.addWidget(self.tune_button, 12, 0)
+        self.gesture_layout.addWidget(self.tune_progress, 12, 1, 1, 2)
+        self.gesture_layout.addWidget(self.tune_label, 13, 0, 1, 3)
+        self.tune_progress.hide()
 
         self.add_button.clicked.connect(self.on_add_button_clicked)
         self.train_button.clicked.connect(self.on_train_button_clicked)
         self.delete_button.clicked.connect(self.on_delete_button_clicked)
         self.record_button.clicked.connect(self.on_record_button_clicked)
         self.stop_record_button.clicked.connect(self.on_stop_record_button_clicked)
+        self.tune_button.clicked.connect(self.on_tune_button_clicked)
 
     # prediction ui: start and stop button
     def init_prediction_ui(self):
@@ -180,14 +246,31 @@ class SvmNode(Node):
         self.pred_layout.addWidget(self.pred_start_button, 11, 0)
         self.pred_layout.addWidget(self.pred_stop_button, 11, 1)
 
+        # predict every `hop` samples, smoothed over the last `votes` predictions
+        self.hop_input = QtGui.QSpinBox()
+        self.hop_input.setRange(1, 1024)
+        self.hop_input.setValue(self.recognizer.scheduler.hop)
+        self.hop_input.valueChanged.connect(self.recognizer.scheduler.set_hop)
+        self.pred_layout.addWidget(QtGui.QLabel("hop (samples):"), 12, 0)
+        self.pred_layout.addWidget(self.hop_input, 12, 1)
+        self.votes_input = QtGui.QSpinBox()
+        self.votes_input.setRange(1, 64)
+        self.votes_input.setValue(self.recognizer.scheduler.votes)
+        self.votes_input.valueChanged.connect(self.recognizer.scheduler.set_votes)
+        self.pred_layout.addWidget(QtGui.QLabel("votes:"), 13, 0)
+        self.pred_layout.addWidget(self.votes_input, 13, 1)
+
         self.pred_start_button.clicked.connect(self.on_pred_start_button_clicked)
         self.pred_stop_button.clicked.connect(self.on_pred_stop_button_clicked)
 
     # new gesture is added to the list
     def on_add_button_clicked(self):
-        self.saved_gestures.append(self.gesture_name.text())
-        self.gesture_select.addItem(self.saved_gestures[-1])
-        self.gestures_dict[self.gesture_name.text()] = []
+        name = self.gesture_name.text()
+        if not name or name in self.saved_gestures:
+            return
+        self.saved_gestures.append(name)
+        self.gesture_select.addItem(name)
+        self.recognizer.add_gesture(name)
         self.gesture_name.setText("")
         self.gesture_id += 1
 
@@ -195,6 +278,10 @@ class SvmNode(Node):
     def on_train_button_clicked(self):
         self.record_button.show()
         self.stop_record_button.show()
+        self.auto_segment_checkbox.show()
+
+    def set_auto_segment(self, auto_segment):
+        self.auto_segment = auto_segment
 
     # starts recording
     def on_record_button_clicked(self):
@@ -207,21 +294,29 @@ class SvmNode(Node):
     # records an activity
     def activity_recording(self, is_recording):
         self.is_recording = is_recording
+        self.segment_recorded = False
         if self.state == GestureNodeState.TRAINING:
             if self.is_recording:
                 self.mode_text_label.setText("Recording...")
             else:
                 self.mode_text_label.setText(self.TRAINING_TEXT)
+                self.recognizer.recordings.flush()
+                self.train_if_changed()
 
     # delets actvity from list
     def on_delete_button_clicked(self):
         gesture_selected = self.gesture_select.currentText()
+        if gesture_selected not in self.saved_gestures:
+            return
         self.saved_gestures.remove(gesture_selected)
         self.gesture_select.clear()
         self.gesture_select.addItems(self.saved_gestures)
+        self.recognizer.delete_gesture(gesture_selected)
+        self.train_if_changed()
 
     # prediction start
     def on_pred_start_button_clicked(self):
+        self.recognizer.scheduler.reset()
         self.is_recording = True
 
     # prediction stop
@@ -254,38 +349,130 @@ class SvmNode(Node):
     def handle_gesture_training(self, kargs):
         if self.is_recording:
             input_val = kargs['dataIn']
+            if input_val is None:
+                # the device is idle, a started gesture is over
+                if self.auto_segment and self.segment_recorded:
+                    self.activity_recording(False)
+                return
             selected_gesture = self.gesture_select.currentText()
-            print(self.gestures_dict)
-            self.gestures_dict[selected_gesture].append(input_val)
-        else:
-            samples = []
-            targets = []
-            for key in self.gestures_dict:
-                for feature in self.gestures_dict[key]:
-                    feature = feature.flatten()
-                    samples.append(feature)
-                    targets.append(key)
-
-            if not all(f == targets[0] for f in targets):
-                self.svc.fit(samples, targets)
-
-    # predicts a gesture category from sensor input
-    def predict_gesture(self, kargs):
-        if self.is_recording:
             try:
-                prediction = self.svc.predict([kargs['dataIn']])
-                print(prediction[0])
-            except NotFittedError:
+                self.recognizer.record(selected_gesture, input_val)
+            except ValueError as e:
+                # no gesture selected, or the feature length changed (e.g. another buffer size)
+                self.mode_text_label.setText(f"not recorded: {e}")
                 return
-            for key in self.gestures_dict:
-                print(key)
-                if key == prediction[0]:
-                    print("yes")
-                    return {'prediction': key}
+            self.segment_recorded = True
+        else:
+            self.train_if_changed()
+
+    # switches between the svm and the incremental classifier
+    def on_classifier_changed(self, classifier):
+        self.recognizer.set_incremental(classifier == "incremental")
+        self.update_model_label()
+        self.train_if_changed()
+
+    # starts training a new model in the background if the recorded data changed since the
+    # last training and no training is running
+    def train_if_changed(self):
+        training = self.recognizer.begin_training()
+        if training is None:
+            if self.recognizer.incremental:
+                self.update_model_label()
+            return
+        self.update_model_label()
+        Thread(target=self.train, args=training, daemon=True).start()
+
+    # runs on the training thread
+    def train(self, samples, targets, version):
+        self.sigModelTrained.emit(GestureRecognizer.fit(samples, targets, self.recognizer.svm_params), version)
+
+    # starts tuning the svm on all cores in the background or cancels a running tuning
+    # the best model is installed when it is done and its parameters are used from then on
+    def on_tune_button_clicked(self):
+        if self.tuner is not None:
+            self.tuner.cancel()
+            self.tune_label.setText("cancelling...")
+            return
+        tuning = self.recognizer.begin_tuning()
+        if tuning is None:
+            self.tune_label.setText("tuning needs the svm classifier, samples of two gestures"
+                                    " and no training running")
+            return
+        self.tuner = GestureTuner()
+        self.tune_button.setText("cancel tuning")
+        self.tune_progress.setValue(0)
+        self.tune_progress.show()
+        self.tune_label.setText(f"tuning on {self.tuner.workers} processes...")
+        self.update_model_label()
+        Thread(target=self.tune, args=(self.tuner,) + tuning, daemon=True).start()
+
+    # runs on the tuning thread
+    def tune(self, tuner, samples, targets, version):
+        try:
+            result = tuner.run(samples, targets, self.sigTuneProgress.emit)
+            message = "" if result is not None else "cancelled"
+        except Exception as e:
+            # e.g. a broken process pool; the GUI thread must always get the tuning back
+            result, message = None, str(e) or type(e).__name__
+        self.sigModelTuned.emit(result, version, message)
+
+    @staticmethod
+    def format_params(params):
+        return ", ".join(f"{key}={value}" for key, value in params.items())
+
+    def on_tune_progress(self, done, total, params, score):
+        self.tune_progress.setRange(0, total)
+        self.tune_progress.setValue(done)
+        self.tune_label.setText(f"best so far: accuracy {score:.3f} with {self.format_params(params)}")
+
+    # runs on the GUI thread, swaps in the tuned model
+    def on_model_tuned(self, result, version, message):
+        self.tuner = None
+        self.tune_button.setText("tune svm")
+        self.tune_progress.hide()
+        if result is None:
+            self.recognizer.cancel_training()
+            self.tune_label.setText(f"tuning stopped: {message}")
+        else:
+            model, params, score = result
+            if self.recognizer.install_tuned_model(model, params, version):
+                self.tune_label.setText(f"tuned: accuracy {score:.3f} with {self.format_params(params)}")
+            else:
+                self.tune_label.setText("tuning dropped: switched to the incremental classifier")
+        self.update_model_label()
+        # the data may have changed while tuning
+        self.train_if_changed()
+
+    # runs on the GUI thread, swaps in the new model
+    def on_model_trained(self, svc, version):
+        if not self.recognizer.install_model(svc, version):
+            # switched classifiers while training
+            return
+        self.update_model_label()
+        # the data may have changed while training
+        self.train_if_changed()
+
+    def update_model_label(self):
+        recognizer = self.recognizer
+        text = f"model v{recognizer.model_version} ({len(recognizer.recordings)} samples)"
+        if recognizer.training_version is not None:
+            text += f", training v{recognizer.training_version}..."
+        self.model_label.setText(text)
+
+    # predicts a gesture category from sensor input every `hop` samples
+    # returns the output only if the smoothed label changed
+    def predict_gesture(self, kargs):
+        if not self.is_recording or kargs['dataIn'] is None:
+            return None
+        samples = kargs['samples']
+        label = self.recognizer.predict(kargs['dataIn'], 1 if samples is None else len(samples))
+        if label is None:
+            return None
+        return {'prediction': label}
 
     # eiter calls the training or prediction method
     def process(self, **kargs):
-        self.output = {'dataIn': "-"}
+        self.output = {'prediction': "-"}
         if self.state == GestureNodeState.TRAINING:
             self.handle_gesture_training(kargs)
 
@@ -297,49 +484,131 @@ class SvmNode(Node):
 fclib.registerNodeType(SvmNode, [('svm',)])
 
 
-# reads in information from a BufferNode and outputs a frequency spectrogram
+# computes the spectrum of the average of the three accelerometer axes
+# the axes are taken from the window input (n x 3, e.g. from a multi-channel BufferNode) if it is
+# connected, otherwise from the separate accelX/accelY/accelZ inputs
+# the samples input (e.g. the timestamps of a DIPPIDNode) tells the incremental mode how many
+# samples are new in the window; without it every spectrum is computed from scratch
 class FftNode(Node):
     nodeName = 'fft'
 
     def __init__(self, name):
         Node.__init__(self, name, terminals={
+            'window': {'io': 'in'},
             'accelX': {'io': 'in'},
             'accelY': {'io': 'in'},
             'accelZ': {'io': 'in'},
+            'samples': {'io': 'in'},
             'frequency': {'io': 'out'},
             })
         self.frequency = None
+        self.spectrum = SpectrumStage()
+        self.init_ui()
+
+    def init_ui(self):
+        self.ui = QtGui.QWidget()
+        self.layout = QtGui.QGridLayout()
+        self.incremental_checkbox = QtGui.QCheckBox("incremental (sliding dft)")
+        self.incremental_checkbox.toggled.connect(self.set_incremental)
+        self.layout.addWidget(self.incremental_checkbox)
+        self.ui.setLayout(self.layout)
+
+    def ctrlWidget(self):
+        return self.ui
+
+    def set_incremental(self, incremental):
+        self.spectrum.set_incremental(incremental)
 
     def process(self, **kargs):
-        avg = []
-        for i in range(len(kargs['accelX'])):
-            avg.append((kargs['accelX'][i] + kargs['accelY'][i] + kargs['accelZ'][i]) / 3)
-        self.frequency = np.abs(np.fft.fft(avg) / len(avg))[1:len(avg) // 2]
+        if kargs['window'] is None and kargs['accelX'] is None:
+            # nothing to do, e.g. an upstream MotionGateNode reports the device as idle
+            return {'frequency': None}
+        window = kargs['window']
+        if window is None:
+            # the buffers may differ in length while they fill up
+            length = min(len(kargs['accelX']), len(kargs['accelY']), len(kargs['accelZ']))
+            window = np.column_stack((kargs['accelX'][-length:], kargs['accelY'][-length:],
+                                      kargs['accelZ'][-length:]))
+        samples = kargs['samples']
+        self.frequency = self.spectrum.process(window, None if samples is None else len(samples))
         return {'frequency': self.frequency}
 
 fclib.registerNodeType(FftNode, [('fft',)])
 
 
+# extracts a feature vector for the SvmNode from a multi-axis window (N x 3, e.g. from a
+# multi-channel BufferNode). the feature families can be switched on and off in the control pane
+class FeatureNode(Node):
+    nodeName = 'features'
+
+    def __init__(self, name):
+        Node.__init__(self, name, terminals={
+            'window': {'io': 'in'},
+            'features': {'io': 'out'},
+            })
+        self.families = list(FEATURE_FAMILIES)
+        self.init_ui()
+
+    def init_ui(self):
+        self.ui = QtGui.QWidget()
+        self.layout = QtGui.QGridLayout()
+        self.family_checkboxes = {}
+        for family in FEATURE_FAMILIES:
+            checkbox = QtGui.QCheckBox(family)
+            checkbox.setChecked(True)
+            checkbox.toggled.connect(self.on_family_toggled)
+            self.layout.addWidget(checkbox)
+            self.family_checkboxes[family] = checkbox
+        self.ui.setLayout(self.layout)
+
+    def ctrlWidget(self):
+        return self.ui
+
+    def on_family_toggled(self):
+        self.families = [family for family in FEATURE_FAMILIES if self.family_checkboxes[family].isChecked()]
+        self.update()
+
+    def process(self, **kargs):
+        window = kargs['window']
+        if window is None:
+            # e.g. an upstream MotionGateNode reports the device as idle
+            return {'features': None}
+        if len(window) == 0:
+            return None
+        return {'features': extract_features(window, self.families)}
+
+fclib.registerNodeType(FeatureNode, [('features',)])
+
+
 # create the notes and connects them
-def create_connect_nodes(chart):
+# if an asyncio loop is given, the DIPPID sensor runs on it instead of a thread
+# if a GestureStore is given, the svm node saves and restores its gestures and model there
+def create_connect_nodes(chart, loop=None, store=None):
     dippid_node = chart.createNode("DIPPID", pos=(0, 0))
-    buffer_node_x = chart.createNode("Buffer", pos=(100, -200))
-    buffer_node_y = chart.createNode("Buffer", pos=(100, 0))
-    buffer_node_z = chart.createNode("Buffer", pos=(100, 200))
-    fft_node = chart.createNode("fft", pos=(200, 100))
-    display_node = chart.createNode("display", pos=(400, 0))
-    svm_node = chart.createNode("svm", pos=(300, 0))
-
-    chart.connectTerminals(dippid_node['accelX'], buffer_node_x['dataIn'])
-    chart.connectTerminals(dippid_node['accelY'], buffer_node_y['dataIn'])
-    chart.connectTerminals(dippid_node['accelZ'], buffer_node_z['dataIn'])
-    chart.connectTerminals(buffer_node_x['dataOut'], fft_node['accelX'])
-    chart.connectTerminals(buffer_node_y['dataOut'], fft_node['accelY'])
-    chart.connectTerminals(buffer_node_z['dataOut'], fft_node['accelZ'])
+    dippid_node.set_event_loop(loop)
+    # one buffer for all three axes, so every update of the DIPPIDNode runs the chain once
+    buffer_node = chart.createNode("Buffer", pos=(100, 0))
+    # skips the rest of the chain while the device lies still
+    gate_node = chart.createNode("MotionGate", pos=(200, 0))
+    fft_node = chart.createNode("fft", pos=(300, 0))
+    display_node = chart.createNode("display", pos=(500, 0))
+    svm_node = chart.createNode("svm", pos=(400, 0))
+    if store is not None:
+        svm_node.set_store(store)
+
+    chart.connectTerminals(dippid_node['accel'], buffer_node['dataIn'])
+    chart.connectTerminals(buffer_node['dataOut'], gate_node['dataIn'])
+    chart.connectTerminals(gate_node['dataOut'], fft_node['window'])
     chart.connectTerminals(fft_node['frequency'], svm_node['dataIn'])
+    chart.connectTerminals(dippid_node['timestamps'], fft_node['samples'])
+    chart.connectTerminals(dippid_node['timestamps'], svm_node['samples'])
     chart.connectTerminals(svm_node['prediction'], display_node['dataIn'])
 
 
+# gestures and models are kept in this directory, unless another one is given on the command line
+DEFAULT_STORE_PATH = 'gesture_data'
+
+
 def start():
     app = QtWidgets.QApplication([])
 
@@ -354,7 +623,14 @@ def start():
     fc = Flowchart(terminals={'out': dict(io='out')})
     layout.addWidget(fc.widget(), 0, 0, 2, 1)
 
-    create_connect_nodes(fc)
+    # one asyncio loop inside the Qt loop receives data for all sensors
+    bridge = AsyncioQtBridge()
+    store_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_STORE_PATH
+    create_connect_nodes(fc, bridge.loop, GestureStore(store_path))
+
+    # per-node timing, off until enabled in the panel
+    profiler_panel = ProfilerPanel(fc)
+    profiler_panel.dock(win)
 
     win.show()
     if (sys.flags.interactive != 1) or not hasattr(QtCore, 'PYQT_VERSION'):
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# micro-benchmark for decoding DIPPID packets in Sensor
+# compares the generic decode path (json module, capability list, dict
+# comparison, dict samples) with the fast path of DIPPID.Sensor, including
+# the conversion of the queued samples to an N x 3 array done by DIPPIDNode,
+# and with binary frames
+# usage: python3 benchmark_decode.py [number of packets]
+import sys
+import json
+import random
+from collections import deque
+from time import monotonic
+from timeit import timeit
+
+import numpy as np
+
+import DIPPID
+from DIPPID import Sensor, encode_binary_frame
+
+
+# the decode path of Sensor before the fast path was added
+class LegacySensor(Sensor):
+    def _update_batch(self, frames):
+        changed = []
+        for data in frames:
+            try:
+                data_json = json.loads(data)
+            except json.decoder.JSONDecodeError:
+                continue
+
+            timestamp = monotonic()
+            for key, value in data_json.items():
+                if key not in self._capabilities:
+                    self._capabilities.append(key)
+                    self._callbacks[key] = []
+                    self._data[key] = []
+                    self._samples[key] = deque(maxlen=self._queue_size)
+                self._samples[key].append((timestamp, value))
+
+                if self._data[key] == []:
+                    self._data[key] = value
+                    continue
+
+                if self._data[key] != value:
+                    self._data[key] = value
+                    if key not in changed:
+                        changed.append(key)
+
+        for key in changed:
+            self._notify_callbacks(key)
+
+    # the generic path kept every sample in a deque
+    def _add_capability(self, key):
+        Sensor._add_capability(self, key)
+        self._samples[key] = deque(maxlen=self._queue_size)
+
+    def drain_accel(self):
+        samples = self._drain('accelerometer')
+        return np.array([[v['x'], v['y'], v['z']] for _, v in samples], dtype=np.float64)
+
+
+class FastSensor(Sensor):
+    def drain_accel(self):
+        return self.drain_vectors('accelerometer')[:, 1:]
+
+
+# packets as sent by the DIPPID app: three vectors and a button
+def create_packets(count):
+    packets = []
+    for i in range(count):
+        packet = {key: {axis: random.uniform(-1, 1) for axis in 'xyz'}
+                  for key in ('accelerometer', 'gyroscope', 'gravity')}
+        packet['button_1'] = i // 50 % 2
+        packets.append(json.dumps(packet).encode())
+    return packets
+
+
+# decodes batches of packets and drains them like DIPPIDNode does
+def run(sensor, packets):
+    for start in range(0, len(packets), 100):
+        sensor._update_batch(packets[start:start + 100])
+        sensor.drain_accel()
+        for key in sensor.get_capabilities():
+            sensor._drain(key)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    packets = create_packets(count)
+    binary_packets = [encode_binary_frame(json.loads(packet)) for packet in packets]
+
+    legacy = LegacySensor()
+    fast = FastSensor()
+    for sensor in (legacy, fast):
+        sensor.register_callback('accelerometer', lambda value: None)
+
+    backend = DIPPID._json_loads.__module__
+    results = [
+        ('generic (json, list lookup)', timeit(lambda: run(legacy, packets), number=3) / 3),
+        (f'fast path ({backend})', timeit(lambda: run(fast, packets), number=3) / 3),
+        ('fast path (binary frames)', timeit(lambda: run(fast, binary_packets), number=3) / 3),
+    ]
+
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(f'{name:32} {count / seconds:12.0f} packets/s  {seconds / count * 1e6:6.2f} us/packet'
+              f'  x{baseline / seconds:.2f}')
+
+    for sensor in (legacy, fast):
+        sensor.disconnect()
+
+
+if __name__ == '__main__':
+    main()
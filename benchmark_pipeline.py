@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# end-to-end benchmark of the recognizer: packets are sent by a synthetic UDP
+# load generator (a separate process), received by SensorUDP (one device) or
+# SensorHub (several devices) and run through the headless pipeline
+# (buffer -> motion gate -> spectrum -> gesture recognizer) of every device
+# measures per-stage and end-to-end latency percentiles, lost and dropped
+# packets and CPU use, and writes the results as json
+# every packet carries its sequence number and send time in the gyroscope
+# values, which the pipeline does not use
+# usage: python3 benchmark_pipeline.py [--rate 100] [--devices 1] [--format json]
+#                                      [--duration 5] [--output results.json]
+#                                      [--baseline previous_results.json]
+import sys
+import json
+import argparse
+import platform
+from multiprocessing import Process, Value
+from time import monotonic, sleep, process_time
+import resource
+
+import numpy as np
+
+from DIPPID import SensorUDP, SensorHub, encode_binary_frame
+from pipeline import Pipeline, GestureRecognizer
+
+# frequencies (Hz) of the synthetic gestures; every device switches between
+# them every GESTURE_DURATION seconds
+GESTURES = {'slow': 1.5, 'fast': 6.0}
+GESTURE_DURATION = 2.0
+PERCENTILES = (50, 90, 99)
+
+
+# accelerometer sample of the synthetic gesture of a device at time t
+def synthetic_sample(t, device, rng):
+    names = list(GESTURES)
+    frequency = GESTURES[names[(int(t / GESTURE_DURATION) + device) % len(names)]]
+    phase = 2 * np.pi * frequency * t
+    return np.sin(phase + np.array([0.0, 0.5, 1.0])) + rng.normal(0, 0.05, 3)
+
+
+def create_packet(values, payload_format):
+    if payload_format == 'binary':
+        return encode_binary_frame(values)
+    return json.dumps(values).encode()
+
+
+# runs in its own process: sends `rate` packets per second and device until
+# `duration` is over, every device from its own socket (so a hub tells them apart)
+def generate_load(port, rate, devices, payload_format, duration, start, sent):
+    import socket
+
+    rng = np.random.default_rng(0)
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(devices)]
+    period = 1 / rate
+    seq = 0
+    while True:
+        due = start + seq * period
+        now = monotonic()
+        if due - start > duration:
+            break
+        if due > now:
+            sleep(due - now)
+        # running late: packets are sent back to back until the schedule is met again
+        for device, sock in enumerate(sockets):
+            x, y, z = synthetic_sample(seq * period, device, rng)
+            values = {
+                'accelerometer': {'x': x, 'y': y, 'z': z},
+                # send time in ms since the start; float32 keeps ~10 us for minutes
+                'gyroscope': {'x': seq, 'y': (monotonic() - start) * 1000, 'z': device},
+            }
+            try:
+                sock.sendto(create_packet(values, payload_format), ('127.0.0.1', port))
+                with sent.get_lock():
+                    sent.value += 1
+            except OSError:
+                pass
+        seq += 1
+    for sock in sockets:
+        sock.close()
+
+
+# a recognizer trained on the synthetic gestures, shared by the pipelines of all devices
+def train_recognizer(rate):
+    recognizer = GestureRecognizer()
+    rng = np.random.default_rng(1)
+    for gesture, frequency in GESTURES.items():
+        recognizer.add_gesture(gesture)
+        pipeline = Pipeline(recognizer)
+        t = np.arange(int(rate * 4 * GESTURE_DURATION)) / rate
+        samples = np.sin(2 * np.pi * frequency * t[:, None] + np.array([0.0, 0.5, 1.0]))
+        samples += rng.normal(0, 0.05, samples.shape)
+        for start in range(0, len(samples), 4):
+            pipeline.push(samples[start:start + 4], gesture=gesture)
+    recognizer.train()
+    return recognizer
+
+
+def summarize(latencies):
+    if not latencies:
+        return None
+    values = np.array(latencies) * 1000
+    summary = {f'p{p}': round(float(np.percentile(values, p)), 4) for p in PERCENTILES}
+    summary['mean'] = round(float(values.mean()), 4)
+    summary['max'] = round(float(values.max()), 4)
+    summary['count'] = len(values)
+    return summary
+
+
+# stages of one block, timed like Pipeline.push() runs them
+STAGES = ('network', 'queue', 'buffer', 'gate', 'spectrum', 'recognizer')
+
+
+def process_block(pipeline, block, latencies):
+    t0 = monotonic()
+    window = pipeline.buffer.process(block)
+    t1 = monotonic()
+    window = pipeline.gate.process(window)
+    t2 = monotonic()
+    feature = pipeline.spectrum.process(window, len(block))
+    t3 = monotonic()
+    prediction = None
+    if feature is not None:
+        prediction = pipeline.recognizer.predict(feature, len(block))
+    t4 = monotonic()
+
+    latencies['buffer'].append(t1 - t0)
+    latencies['gate'].append(t2 - t1)
+    latencies['spectrum'].append(t3 - t2)
+    latencies['recognizer'].append(t4 - t3)
+    return prediction, t4
+
+
+def run(args):
+    recognizer = train_recognizer(args.rate)
+    if args.devices > 1:
+        hub = SensorHub(args.port)
+        sensors = {}
+    else:
+        hub = None
+        sensors = {'0': SensorUDP(args.port)}
+    pipelines = {}
+
+    latencies = {stage: [] for stage in STAGES + ('end_to_end',)}
+    received = 0
+    predictions = 0
+    sent = Value('q', 0)
+    start = monotonic() + 0.2
+    generator = Process(target=generate_load, args=(args.port, args.rate, args.devices, args.format,
+                                                    args.duration, start, sent))
+    cpu_start = process_time()
+    wall_start = monotonic()
+    generator.start()
+
+    try:
+        while generator.is_alive() or monotonic() < start + args.duration + 0.5:
+            if hub is not None:
+                sensors = {device_id: hub.get_device(device_id) for device_id in hub.get_devices()}
+            for device_id, sensor in list(sensors.items()):
+                if not sensor.has_capability('accelerometer'):
+                    continue
+                accel = sensor.drain_vectors('accelerometer')
+                gyro = sensor.drain_vectors('gyroscope')
+                if not len(accel):
+                    continue
+                drained = monotonic()
+                received += len(accel)
+                for receive_time, _, send_ms, _ in gyro:
+                    send_time = start + send_ms / 1000
+                    latencies['network'].append(receive_time - send_time)
+                    latencies['queue'].append(drained - receive_time)
+
+                pipeline = pipelines.get(device_id)
+                if pipeline is None:
+                    pipeline = pipelines[device_id] = Pipeline(recognizer)
+                block = accel[:, 1:]
+                prediction, done = process_block(pipeline, block, latencies)
+                if prediction is not None:
+                    predictions += 1
+                for _, _, send_ms, _ in gyro:
+                    latencies['end_to_end'].append(done - (start + send_ms / 1000))
+            sleep(args.interval)
+
+    finally:
+        generator.join()
+        # the hub counts received and malformed packets, its devices the dropped samples
+        receivers = [hub] if hub is not None else list(sensors.values())
+        for sensor in receivers:
+            sensor.disconnect()
+    wall = monotonic() - wall_start
+    cpu = process_time() - cpu_start
+    generator_cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+    generator_cpu = generator_cpu.ru_utime + generator_cpu.ru_stime
+
+    stats = {'received': 0, 'malformed': 0}
+    for sensor in receivers:
+        for key in stats:
+            stats[key] += sensor.get_stats()[key]
+    queue_dropped = sum(sensor.get_stats()['dropped'] for sensor in sensors.values())
+
+    return {
+        'config': {
+            'rate': args.rate,
+            'devices': args.devices,
+            'format': args.format,
+            'duration': args.duration,
+            'interval': args.interval,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'packets': {
+            'sent': sent.value,
+            'received': stats['received'],
+            'processed': received,
+            # never arrived, e.g. dropped by the kernel receive buffer
+            'lost': sent.value - stats['received'],
+            # overflowed a drained sample queue (see Sensor.get_stats()); every key the
+            # generator sends is drained, so these are packets the loop was too slow for
+            'dropped': queue_dropped,
+            'malformed': stats['malformed'],
+            'throughput': round(received / wall, 1),
+        },
+        'predictions': predictions,
+        'cpu': {
+            'receiver_percent': round(100 * cpu / wall, 1),
+            'generator_percent': round(100 * generator_cpu / wall, 1),
+        },
+        'latency_ms': {stage: summarize(values) for stage, values in latencies.items()},
+    }
+
+
+def print_results(results, baseline=None):
+    packets = results['packets']
+    print(f"sent {packets['sent']}, received {packets['received']}, lost {packets['lost']}, "
+          f"dropped {packets['dropped']}, {packets['throughput']} packets/s, "
+          f"cpu {results['cpu']['receiver_percent']}%")
+    print(f"{'stage':12} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}   (ms)")
+    for stage, summary in results['latency_ms'].items():
+        if summary is None:
+            continue
+        line = f"{stage:12} " + ' '.join(f"{summary[key]:9.3f}" for key in ('p50', 'p90', 'p99', 'max'))
+        previous = (baseline or {}).get('latency_ms', {}).get(stage)
+        if previous and previous['p50'] > 0:
+            line += f"   p50 x{summary['p50'] / previous['p50']:.2f} vs baseline"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="end-to-end benchmark of the recognizer")
+    parser.add_argument('--rate', type=float, default=100, help='packets per second and device')
+    parser.add_argument('--devices', type=int, default=1)
+    parser.add_argument('--format', choices=('json', 'binary'), default='json')
+    parser.add_argument('--duration', type=float, default=5, help='seconds')
+    parser.add_argument('--interval', type=float, default=0.01,
+                        help='seconds between two drains of the sensors, like the DIPPIDNode timer')
+    parser.add_argument('--port', type=int, default=5800)
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--baseline', help='compare with the results of an earlier run')
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+import os
+import json
+import pickle
+
+import numpy as np
+
+# on-disk store for the recorded gestures and the trained model of the SvmNode
+# a store is a directory with these files:
+#   recordings.json  format version, gesture names, row count and dataset version
+#   features.f64     feature matrix (rows x width, float64), memory-mapped
+#   labels.i32       gesture id of every row (int32), memory-mapped
+#   model.pickle     the trained model(s) and the dataset version they were trained on
+# the recordings are memory-mapped, so opening a store is fast regardless of its size and
+# samples are only read from disk when they are used
+# stores written with another format version are ignored
+
+FORMAT_VERSION = 2
+
+RECORDINGS_FILE = 'recordings.json'
+FEATURES_FILE = 'features.f64'
+LABELS_FILE = 'labels.i32'
+MODEL_FILE = 'model.pickle'
+
+
+# writes a file under a temporary name first, so a crash never leaves half a file
+def _write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# append-only, columnar store for the recorded samples of all gestures
+# all samples of a store have the same number of features (width), set by the first sample;
+# it can only change while the store holds no samples
+# rows are appended to one contiguous feature matrix, with a label column holding the gesture
+# id and, per gesture, the row ranges (offsets) it was recorded in
+# deleting a gesture only marks it as deleted (tombstone), its rows are removed by compact(),
+# which training_data() runs when needed
+# with a path the columns are memory-mapped files in that directory, without one they are
+# kept in memory. call flush() to make appended rows and deletions durable
+class RecordingStore:
+    INITIAL_CAPACITY = 256
+    # number of rows moved at once while compacting
+    COMPACT_CHUNK = 4096
+
+    def __init__(self, path=None):
+        self.path = path
+        self.width = None
+        self.rows = 0
+        self.capacity = 0
+        # changes with every appended row, added or deleted gesture
+        self.version = 0
+        # gesture id -> name, ids of deleted gestures are never reused
+        self.names = []
+        self.deleted = set()
+        # gesture id -> list of [start, end) row ranges
+        self.offsets = {}
+        # rows of deleted gestures that were not compacted yet
+        self.deleted_rows = 0
+        self.features = None
+        self.labels = None
+        # name -> id of all gestures that are not deleted
+        self._ids = {}
+
+        if path is not None and os.path.exists(self._file(RECORDINGS_FILE)):
+            self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        with open(self._file(RECORDINGS_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('format_version') != FORMAT_VERSION:
+            print(f"ignoring recordings in {self.path}: unsupported format version")
+            return
+
+        self.width = meta['width']
+        self.rows = meta['rows']
+        self.capacity = meta['capacity']
+        self.version = meta['version']
+        self.names = meta['names']
+        self.deleted = set(meta['deleted'])
+        self.offsets = {int(gid): ranges for gid, ranges in meta['offsets'].items()}
+        self.deleted_rows = meta['deleted_rows']
+        self._ids = {name: gid for gid, name in enumerate(self.names) if gid not in self.deleted}
+        if self.width is not None:
+            self._map(self.capacity)
+
+    # (re)maps both columns with the given capacity, growing the files if needed
+    def _map(self, capacity):
+        if self.path is None:
+            features = np.zeros((capacity, self.width))
+            labels = np.zeros(capacity, dtype=np.int32)
+            if self.features is not None:
+                features[:self.rows] = self.features[:self.rows]
+                labels[:self.rows] = self.labels[:self.rows]
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            for name, row_bytes in ((FEATURES_FILE, 8 * self.width), (LABELS_FILE, 4)):
+                with open(self._file(name), 'ab') as f:
+                    f.truncate(capacity * row_bytes)
+            features = np.memmap(self._file(FEATURES_FILE), dtype=np.float64, mode='r+',
+                                 shape=(capacity, self.width))
+            labels = np.memmap(self._file(LABELS_FILE), dtype=np.int32, mode='r+', shape=(capacity,))
+        self.features = features
+        self.labels = labels
+        self.capacity = capacity
+
+    # names of all gestures that are not deleted, in the order they were added
+    def gestures(self):
+        return list(self._ids)
+
+    def has_gesture(self, name):
+        return name in self._ids
+
+    def add_gesture(self, name):
+        if name in self._ids:
+            return
+        self._ids[name] = len(self.names)
+        self.offsets[len(self.names)] = []
+        self.names.append(name)
+        self.version += 1
+
+    # O(1) apart from counting the rows for compact()
+    def delete_gesture(self, name):
+        gid = self._ids.pop(name, None)
+        if gid is None:
+            return
+        self.deleted.add(gid)
+        self.deleted_rows += sum(end - start for start, end in self.offsets[gid])
+        self.version += 1
+
+    # appends one sample, raises ValueError if its length does not match the store
+    def append(self, name, feature):
+        gid = self._ids.get(name)
+        if gid is None:
+            raise ValueError(f'unknown gesture "{name}"')
+
+        feature = np.asarray(feature, dtype=np.float64).ravel()
+        if len(feature) != self.width and len(self) == 0:
+            self.compact()
+            self.width = len(feature)
+            self.features = None
+            self._map(max(self.INITIAL_CAPACITY, self.capacity))
+        if len(feature) != self.width:
+            raise ValueError(f'expected {self.width} features, got {len(feature)}')
+        if self.rows == self.capacity:
+            self._map(max(self.INITIAL_CAPACITY, 2 * self.capacity))
+
+        row = self.rows
+        self.features[row] = feature
+        self.labels[row] = gid
+        ranges = self.offsets[gid]
+        if ranges and ranges[-1][1] == row:
+            ranges[-1][1] = row + 1
+        else:
+            ranges.append([row, row + 1])
+        self.rows += 1
+        self.version += 1
+
+    # number of samples per gesture
+    def counts(self):
+        return {name: sum(end - start for start, end in self.offsets[gid]) for name, gid in self._ids.items()}
+
+    def __len__(self):
+        return self.rows - self.deleted_rows
+
+    # zero-copy views of the samples of one gesture, one per recorded row range
+    def gesture_features(self, name):
+        return [self.features[start:end] for start, end in self.offsets[self._ids[name]]]
+
+    # removes the rows of deleted gestures by moving the remaining rows to the front
+    def compact(self):
+        if self.deleted_rows == 0:
+            return
+
+        deleted = np.array(sorted(self.deleted), dtype=np.int32)
+        kept = np.flatnonzero(~np.isin(self.labels[:self.rows], deleted))
+        # kept[i] >= i, so moving chunks front to back never overwrites rows still to be moved
+        for start in range(0, len(kept), self.COMPACT_CHUNK):
+            chunk = kept[start:start + self.COMPACT_CHUNK]
+            self.features[start:start + len(chunk)] = self.features[chunk]
+            self.labels[start:start + len(chunk)] = self.labels[chunk]
+        self.rows = len(kept)
+        self.deleted_rows = 0
+
+        self.offsets = {gid: [] for gid in self.offsets if gid not in self.deleted}
+        labels = self.labels[:self.rows]
+        boundaries = np.flatnonzero(np.diff(labels)) + 1
+        for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [self.rows]))):
+            if start < end:
+                self.offsets[int(labels[start])].append([int(start), int(end)])
+        self.flush()
+
+    # all samples as a zero-copy view of the feature matrix and their gesture names
+    def training_data(self):
+        self.compact()
+        if self.width is None:
+            return np.zeros((0, 0)), np.array([], dtype=object)
+        names = np.array(self.names, dtype=object)
+        return self.features[:self.rows], names[self.labels[:self.rows]]
+
+    def flush(self):
+        if self.path is None:
+            return
+        if self.features is not None:
+            self.features.flush()
+            self.labels.flush()
+        os.makedirs(self.path, exist_ok=True)
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'width': self.width,
+            'rows': self.rows,
+            'capacity': self.capacity,
+            'version': self.version,
+            'names': self.names,
+            'deleted': sorted(self.deleted),
+            'offsets': self.offsets,
+            'deleted_rows': self.deleted_rows,
+        }
+        _write_atomic(self._file(RECORDINGS_FILE), json.dumps(meta).encode())
+
+
+class GestureStore:
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    # opens the recorded samples of this store
+    def open_recordings(self):
+        return RecordingStore(self.path)
+
+    # returns the model state saved by save_model() or None
+    def load_model(self):
+        try:
+            with open(self._file(MODEL_FILE), 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        if state.get('format_version') != FORMAT_VERSION:
+            return None
+        return state
+
+    # saves the trained model(s), state is a dict that is pickled as is
+    def save_model(self, state):
+        os.makedirs(self.path, exist_ok=True)
+        state = dict(state, format_version=FORMAT_VERSION)
+        _write_atomic(self._file(MODEL_FILE), pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
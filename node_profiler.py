@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# opt-in profiling of pyqtgraph flowchart nodes: times every process() call,
+# counts calls per second and keeps a rolling window of durations per node
+# NodeProfiler does the bookkeeping, ProfilerPanel shows it in a dock widget
+import csv
+import json
+from collections import deque
+from time import perf_counter, monotonic
+
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui, QtCore
+
+
+class NodeStats:
+    """
+    Durations of the last WINDOW process() calls of one node and the times
+    of the calls of the last RATE_WINDOW seconds.
+    """
+    WINDOW = 2048
+    RATE_WINDOW = 5.0
+    # histogram bins in seconds, log spaced from 1 us to 1 s
+    BINS = np.logspace(-6, 0, 25)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.durations = deque(maxlen=self.WINDOW)
+        self.call_times = deque()
+
+    def add(self, when, duration):
+        self.calls += 1
+        self.total += duration
+        self.durations.append(duration)
+        self.call_times.append(when)
+
+    # calls per second over the last RATE_WINDOW seconds
+    def rate(self, now=None):
+        now = monotonic() if now is None else now
+        call_times = self.call_times
+        while call_times and call_times[0] < now - self.RATE_WINDOW:
+            call_times.popleft()
+        return len(call_times) / self.RATE_WINDOW
+
+    # counts of the rolling window of durations per bin of BINS
+    def histogram(self):
+        counts, _ = np.histogram(np.fromiter(self.durations, float), bins=self.BINS)
+        return counts
+
+    # summary in milliseconds
+    def summary(self):
+        durations = np.fromiter(self.durations, float) * 1000
+        summary = {'calls': self.calls, 'errors': self.errors, 'rate': round(self.rate(), 2),
+                   'total_ms': round(self.total * 1000, 3)}
+        for key, value in (('mean_ms', np.mean), ('p50_ms', np.median),
+                           ('p90_ms', lambda d: np.percentile(d, 90)),
+                           ('p99_ms', lambda d: np.percentile(d, 99)), ('max_ms', np.max)):
+            summary[key] = round(float(value(durations)), 4) if len(durations) else None
+        return summary
+
+
+class NodeProfiler:
+    """
+    Times the process() calls of the nodes of a flowchart.
+    attach() instruments all nodes of a flowchart, including nodes added
+    later; detach() restores the original process() methods, so a profiler
+    that is not attached costs nothing.
+    The durations include everything process() does (e.g. a buffer update or
+    an svm prediction), but not the propagation to downstream nodes.
+    Nodes that raise are counted as errors.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._originals = {}
+        self._chart = None
+
+    def attach(self, chart):
+        self.detach()
+        self._chart = chart
+        for node in chart.nodes().values():
+            # the input and output nodes of the chart only pass data through
+            if node is not chart.inputNode and node is not chart.outputNode:
+                self.instrument(node)
+        chart.sigChartChanged.connect(self._on_chart_changed)
+
+    def detach(self):
+        if self._chart is not None:
+            self._chart.sigChartChanged.disconnect(self._on_chart_changed)
+            self._chart = None
+        for node in list(self._originals):
+            self.uninstrument(node)
+
+    def is_attached(self):
+        return self._chart is not None
+
+    def _on_chart_changed(self, chart, action, node):
+        if action == 'add':
+            self.instrument(node)
+        elif action == 'remove':
+            self.uninstrument(node)
+            self.stats.pop(node, None)
+
+    def instrument(self, node):
+        if node in self._originals or not hasattr(node, 'process'):
+            return
+        process = node.process
+        stats = self.stats.setdefault(node, NodeStats())
+
+        def timed_process(**kwargs):
+            start = perf_counter()
+            try:
+                return process(**kwargs)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.add(monotonic(), perf_counter() - start)
+
+        self._originals[node] = process
+        node.process = timed_process
+
+    def uninstrument(self, node):
+        if self._originals.pop(node, None) is not None:
+            # the instance attribute hides the method, removing it restores the method
+            del node.process
+
+    def reset(self):
+        for stats in self.stats.values():
+            stats.reset()
+
+    # summaries of all nodes by node name
+    def summary(self):
+        return {node.name(): stats.summary() for node, stats in self.stats.items()}
+
+    # writes the summaries as csv or json, depending on the file extension
+    def dump(self, path):
+        summary = self.summary()
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = None
+                for name, row in summary.items():
+                    if writer is None:
+                        writer = csv.DictWriter(f, fieldnames=['node'] + list(row))
+                        writer.writeheader()
+                    writer.writerow(dict(row, node=name))
+        else:
+            with open(path, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+
+class ProfilerPanel(QtGui.QWidget):
+    """
+    Live view of a NodeProfiler: a table with calls per second and latency
+    percentiles per node and the rolling latency histogram of the selected
+    node. Profiling is off until "profile nodes" is checked; the stats can
+    be reset and saved as csv or json.
+    Usually placed in a QDockWidget, see dock().
+    """
+    HEADERS = ('node', 'calls/s', 'mean ms', 'p50 ms', 'p99 ms', 'max ms', 'errors')
+    KEYS = ('rate', 'mean_ms', 'p50_ms', 'p99_ms', 'max_ms', 'errors')
+
+    def __init__(self, chart, profiler=None, interval=1000, parent=None):
+        QtGui.QWidget.__init__(self, parent)
+        self.chart = chart
+        self.profiler = profiler if profiler is not None else NodeProfiler()
+        self._init_ui()
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(interval)
+
+    def _init_ui(self):
+        layout = QtGui.QGridLayout()
+
+        self.enable_checkbox = QtGui.QCheckBox("profile nodes")
+        self.enable_checkbox.toggled.connect(self.set_enabled)
+        layout.addWidget(self.enable_checkbox, 0, 0)
+        reset_button = QtGui.QPushButton("reset")
+        reset_button.clicked.connect(self.reset)
+        layout.addWidget(reset_button, 0, 1)
+        save_button = QtGui.QPushButton("save...")
+        save_button.clicked.connect(self.save)
+        layout.addWidget(save_button, 0, 2)
+
+        self.table = QtGui.QTableWidget(0, len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.table.itemSelectionChanged.connect(self.refresh_histogram)
+        layout.addWidget(self.table, 1, 0, 1, 3)
+
+        self.plot = pg.PlotWidget()
+        self.plot.setLabel('bottom', 'process() duration (log10 s)')
+        self.plot.setLabel('left', 'calls')
+        self.histogram = pg.BarGraphItem(x=[], height=[], width=0.2)
+        self.plot.addItem(self.histogram)
+        layout.addWidget(self.plot, 2, 0, 1, 3)
+        self.setLayout(layout)
+
+    def set_enabled(self, enabled):
+        if enabled:
+            self.profiler.attach(self.chart)
+        else:
+            self.profiler.detach()
+
+    def reset(self):
+        self.profiler.reset()
+        self.refresh()
+
+    def save(self):
+        path, _ = QtGui.QFileDialog.getSaveFileName(self, "save node stats", "node_stats.json",
+                                                    "JSON (*.json);;CSV (*.csv)")
+        if path:
+            self.profiler.dump(path)
+
+    def refresh(self):
+        if not self.profiler.is_attached() or not self.isVisible():
+            return
+        summary = self.profiler.summary()
+        selected = self._selected_node()
+        self.table.setRowCount(len(summary))
+        for row, (name, values) in enumerate(summary.items()):
+            self.table.setItem(row, 0, QtGui.QTableWidgetItem(name))
+            for column, key in enumerate(self.KEYS, 1):
+                value = values[key]
+                self.table.setItem(row, column, QtGui.QTableWidgetItem('-' if value is None else str(value)))
+            if name == selected:
+                self.table.selectRow(row)
+        self.refresh_histogram()
+
+    def _selected_node(self):
+        rows = self.table.selectionModel().selectedRows()
+        if not rows:
+            return None
+        item = self.table.item(rows[0].row(), 0)
+        return item.text() if item is not None else None
+
+    def refresh_histogram(self):
+        name = self._selected_node()
+        stats = next((stats for node, stats in self.profiler.stats.items() if node.name() == name), None)
+        if stats is None:
+            self.histogram.setOpts(x=[], height=[])
+            return
+        centers = np.log10(np.sqrt(NodeStats.BINS[:-1] * NodeStats.BINS[1:]))
+        self.histogram.setOpts(x=centers, height=stats.histogram(), width=0.2)
+
+    # puts the panel into a dock widget on the right side of a QMainWindow
+    def dock(self, window, title="node performance"):
+        dock = QtGui.QDockWidget(title, window)
+        dock.setWidget(self)
+        window.addDockWidget(QtCore.Qt.RightDockWidgetArea, dock)
+        return dock
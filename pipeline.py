@@ -0,0 +1,804 @@
+# the activity recognizer as a plain python streaming pipeline, without Qt
+# blocks of accelerometer samples go in, predicted gestures come out:
+#   BufferStage -> MotionGate -> SpectrumStage -> GestureRecognizer
+# the flowchart nodes of activity_recognizer.py and DIPPID_pyqtnode.py are thin wrappers
+# around these stages; Pipeline chains them for servers, tests and benchmarks, e.g.
+#   pipeline = Pipeline()
+#   pipeline.recognizer.set_store(GestureStore('gesture_data'))
+#   for gesture in pipeline.run(sensor_blocks(SensorUDP(5700))):
+#       print(gesture)
+import os
+import random
+import threading
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from time import sleep
+
+import numpy as np
+from sklearn import svm
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.exceptions import NotFittedError
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import make_pipeline
+
+from gesture_store import RecordingStore
+
+
+class RingBuffer:
+    """
+    Fixed-size, preallocated circular buffer for samples with one or more
+    channels.
+    Every sample is written twice (at i and i + capacity), so the last n
+    samples are always available as one contiguous, ordered view without
+    copying. Writing a sample is O(1).
+    """
+
+    def __init__(self, capacity, channels=1, dtype=np.float64):
+        self.capacity = max(1, int(capacity))
+        self.channels = channels
+        self._storage = np.zeros((2 * self.capacity, channels), dtype=dtype)
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, sample):
+        i = self._head
+        self._storage[i] = sample
+        self._storage[i + self.capacity] = sample
+        self._head = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def extend(self, samples):
+        samples = np.asarray(samples, dtype=self._storage.dtype).reshape(-1, self.channels)
+        # only the newest samples survive if more arrive than fit
+        samples = samples[-self.capacity:]
+        n = len(samples)
+        if n == 0:
+            return
+
+        storage = self._storage
+        capacity = self.capacity
+        head = self._head
+        first = min(n, capacity - head)
+        storage[head:head + first] = samples[:first]
+        storage[head + capacity:head + capacity + first] = samples[:first]
+        if first < n:
+            # wrapped around
+            storage[:n - first] = samples[first:]
+            storage[capacity:capacity + n - first] = samples[first:]
+        self._head = (head + n) % capacity
+        self._count = min(self._count + n, self.capacity)
+
+    # zero-copy, oldest-first view of the buffered samples (read only)
+    def view(self):
+        storage, start = self.view_with_offset()
+        view = storage[start:start + self._count]
+        view.flags.writeable = False
+        return view
+
+    # raw storage and offset of the oldest sample, for consumers that want
+    # to index the ring themselves: storage[offset:offset + len(buffer)]
+    def view_with_offset(self):
+        return self._storage, self._head + self.capacity - self._count
+
+    # changes the capacity while keeping the newest samples
+    def resize(self, capacity):
+        capacity = max(1, int(capacity))
+        if capacity == self.capacity:
+            return
+
+        kept = self.view()[-capacity:].copy()
+        self.capacity = capacity
+        self._storage = np.zeros((2 * capacity, self.channels), dtype=self._storage.dtype)
+        self._head = 0
+        self._count = 0
+        self.extend(kept)
+
+
+# keeps the last `size` samples of a stream of sample blocks and outputs them as one window:
+# an n x C view for multi-channel input (e.g. n x 3 accelerometer blocks), a 1-D array for a
+# single channel. the window is a read-only view that is only valid until the next block
+# outputs None until the buffer is full, so downstream stages (and the recordings) only ever
+# see windows of `size` samples
+class BufferStage:
+
+    def __init__(self, size=32):
+        self.size = size
+        self.buffer = None
+
+    def set_size(self, size):
+        self.size = size
+        if self.buffer is not None:
+            self.buffer.resize(size)
+
+    def is_full(self):
+        return self.buffer is not None and len(self.buffer) == self.buffer.capacity
+
+    # None (e.g. an unconnected input) is passed on without touching the buffer
+    def process(self, data):
+        if data is None:
+            return None
+        data = np.asarray(data, dtype=np.float64)
+        channels = data.shape[1] if data.ndim == 2 else 1
+
+        if self.buffer is None or self.buffer.channels != channels:
+            self.buffer = RingBuffer(self.size, channels)
+        self.buffer.extend(data)
+        if not self.is_full():
+            return None
+
+        out = self.buffer.view()
+        if channels == 1:
+            out = out[:, 0]
+        return out
+
+
+# passes windows on only while the device is moving
+# the motion energy is the summed per-axis variance of the window. the gate opens when it
+# exceeds the threshold and closes after it stayed below half the threshold for `hold`
+# windows, so short pauses within a gesture do not split it. a threshold of 0 always passes
+class MotionGate:
+    STOP_RATIO = 0.5
+
+    def __init__(self, threshold=0.01, hold=10):
+        self.threshold = threshold
+        self.hold = hold
+        self.active = False
+        self.energy = 0.0
+        self._quiet_updates = 0
+
+    # the window while the gate is open, None while it is closed
+    def process(self, data):
+        if data is None:
+            self.active = False
+            return None
+
+        data = np.asarray(data, dtype=np.float64)
+        self.energy = float(data.var(axis=0).sum()) if len(data) else 0.0
+        if self.threshold <= 0 or self.energy > self.threshold:
+            self._quiet_updates = 0
+            self.active = True
+        elif self.active and self.energy < self.threshold * self.STOP_RATIO:
+            self._quiet_updates += 1
+            if self._quiet_updates > self.hold:
+                self.active = False
+        return data if self.active else None
+
+
+# spectrum of a sliding window, updated in O(bins) per new sample instead of a full fft
+# keeps the dft bins 1 .. window // 2 - 1 (the ones the SpectrumStage outputs) of the last `window`
+# samples, which are kept in a RingBuffer. k new samples are applied in one vectorized step:
+#   X' = X * w^k + sum_j (new_j - old_j) * w^(k - j),  w = exp(2 pi i bin / window)
+# with the powers of w cached (one row per power) for the largest k seen so far. rounding errors add up with every update, so the
+# spectrum is recomputed with a full fft every `resync_interval` samples
+class SlidingDFT:
+
+    def __init__(self, window, resync_interval=1024):
+        self.window = window
+        self.resync_interval = resync_interval
+        self.bins = np.arange(1, window // 2)
+        # powers[p] = w^p of every bin, grown on demand by _powers()
+        self.powers = np.ones((1, len(self.bins)), dtype=np.complex128)
+        self.spectrum = np.zeros(len(self.bins), dtype=np.complex128)
+        self.history = RingBuffer(window)
+        self.since_resync = 0
+
+    # oldest-first view of the samples the spectrum belongs to
+    @property
+    def samples(self):
+        return self.history.view()[:, 0]
+
+    # starts over from a complete window
+    def resync(self, samples):
+        self.history.extend(samples)
+        self.spectrum = np.fft.fft(self.samples)[self.bins]
+        self.since_resync = 0
+
+    # checks in O(1) whether a window whose oldest sample is `first` is the current one slid
+    # by `count` samples
+    def continues(self, first, count):
+        if len(self.history) != self.window or not 0 <= count < self.window:
+            return False
+        storage, offset = self.history.view_with_offset()
+        return storage[offset + count, 0] == first
+
+    # slides the window over the new samples
+    def update(self, new_samples):
+        new_samples = np.asarray(new_samples, dtype=np.float64)
+        k = len(new_samples)
+        if k == 0:
+            return
+        if self.since_resync + k >= self.resync_interval or k >= self.window:
+            self.resync(new_samples if k >= self.window else
+                        np.concatenate((self.samples[k:], new_samples)))
+            return
+
+        powers = self._powers(k)
+        storage, offset = self.history.view_with_offset()
+        difference = new_samples - storage[offset:offset + k, 0]
+        # the newest sample gets w^1, the oldest w^k: a contiguous block of rows
+        self.spectrum = self.spectrum * powers[k] + difference[::-1].astype(np.complex128) @ powers[1:k + 1]
+        self.history.extend(new_samples)
+        self.since_resync += k
+
+    # w^0 .. w^k (at least), for every bin
+    def _powers(self, k):
+        if len(self.powers) <= k:
+            exponents = np.arange(min(2 * k, self.window) + 1)
+            self.powers = np.exp(2j * np.pi * np.outer(exponents, self.bins) / self.window)
+        return self.powers
+
+    # magnitudes normalized like np.abs(np.fft.fft(window) / window)
+    def magnitudes(self):
+        return np.abs(self.spectrum) / self.window
+
+
+# spectrum of the average of all axes of a window (n x axes, or 1-D for a single axis):
+# the magnitudes of the dft bins 1 .. n // 2 - 1. with incremental set, a SlidingDFT is
+# updated with the new samples of every window instead of computing a full fft; process()
+# then needs the number of new samples (e.g. the length of the block the buffer just got).
+# without it, or if the window does not continue the previous one, the spectrum is
+# recomputed from scratch. an update costs the same for every window length, about as much
+# as a full fft of ~128 samples; shorter windows are cheaper without incremental
+class SpectrumStage:
+
+    def __init__(self, incremental=False):
+        self.incremental = incremental
+        self.sliding_dft = None
+
+    def set_incremental(self, incremental):
+        self.incremental = incremental
+        self.sliding_dft = None
+
+    # None (e.g. from a closed MotionGate) is passed on
+    def process(self, window, new_samples=None):
+        if window is None:
+            return None
+        window = np.asarray(window)
+        if self.incremental:
+            return self.sliding_spectrum(window, new_samples)
+        avg = self.average(window)
+        return np.abs(np.fft.fft(avg) / len(avg))[1:len(avg) // 2]
+
+    # the mean of every row, without the overhead of ndarray.mean() on a few samples
+    @staticmethod
+    def average(rows):
+        return rows.sum(axis=1) / rows.shape[1] if rows.ndim == 2 else rows
+
+    # only the new rows of the window are averaged, apart from a resync
+    def sliding_spectrum(self, window, new_samples=None):
+        length = len(window)
+        dft = self.sliding_dft
+        if dft is None or dft.window != length:
+            dft = self.sliding_dft = SlidingDFT(length)
+            dft.resync(self.average(window))
+        elif new_samples is None or not dft.continues(self.average(window[:1])[0], new_samples):
+            dft.resync(self.average(window))
+        elif new_samples:
+            dft.update(self.average(window[-new_samples:]))
+        return dft.magnitudes()
+
+
+# feature families computed by extract_features() and the FeatureNode, in output order
+FEATURE_FAMILIES = ('spectrum', 'std', 'mean', 'derivative', 'correlation')
+
+
+# computes features of one window (N x axes) or of many windows at once (windows x N x axes)
+# in a single vectorized pass and returns them as one flat float32 vector per window:
+#   spectrum: magnitudes of the hann-windowed rfft of every axis, without the dc bin
+#   std, mean: standard deviation and mean of every axis
+#   derivative: mean squared difference of consecutive samples of every axis
+#   correlation: pearson correlation of every pair of axes (xy, xz, yz)
+def extract_features(windows, families=FEATURE_FAMILIES):
+    windows = np.asarray(windows, dtype=np.float64)
+    single = windows.ndim == 2
+    if single:
+        windows = windows[None]
+    count, length, axes = windows.shape
+
+    parts = []
+    if 'spectrum' in families:
+        spectrum = np.abs(np.fft.rfft(windows * np.hanning(length)[None, :, None], axis=1)) / length
+        parts.append(spectrum[:, 1:].transpose(0, 2, 1).reshape(count, -1))
+    mean = windows.mean(axis=1)
+    std = windows.std(axis=1)
+    if 'std' in families:
+        parts.append(std)
+    if 'mean' in families:
+        parts.append(mean)
+    if 'derivative' in families:
+        parts.append((np.diff(windows, axis=1) ** 2).sum(axis=1) / max(length - 1, 1))
+    if 'correlation' in families:
+        centered = windows - mean[:, None, :]
+        covariance = np.einsum('bni,bnj->bij', centered, centered) / length
+        scale = std[:, :, None] * std[:, None, :]
+        correlation = np.divide(covariance, scale, out=np.zeros_like(covariance), where=scale > 0)
+        upper = np.triu_indices(axes, 1)
+        parts.append(correlation[:, upper[0], upper[1]])
+
+    features = np.concatenate(parts, axis=1).astype(np.float32) if parts else np.zeros((count, 0), np.float32)
+    return features[0] if single else features
+
+
+# streaming classifier for the SvmNode that learns from one sample at a time in constant time
+# keeps count, sum and sum of squares of the features per gesture. predicts the gesture with
+# the nearest mean after scaling every feature by the pooled within-gesture standard deviation
+# (a linear classifier, like diagonal LDA). unlike stochastic gradient descent it does not
+# depend on the order of the samples, so recording one gesture after another works.
+# new gestures can be added and removed at any time. predict() returns gesture names like svm.SVC
+class IncrementalGestureClassifier:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n_features = None
+        self.counts = {}
+        self.sums = {}
+        self.squares = {}
+
+    # learns one sample of the given gesture
+    def partial_fit(self, feature, label):
+        feature = np.asarray(feature, dtype=np.float64).ravel()
+        if len(feature) != self.n_features:
+            # e.g. the buffer size changed, old statistics do not fit anymore
+            self.reset()
+            self.n_features = len(feature)
+
+        if label not in self.counts:
+            self.counts[label] = 0
+            self.sums[label] = np.zeros(self.n_features)
+            self.squares[label] = np.zeros(self.n_features)
+        self.counts[label] += 1
+        self.sums[label] += feature
+        self.squares[label] += feature * feature
+
+    def remove_label(self, label):
+        for stats in (self.counts, self.sums, self.squares):
+            stats.pop(label, None)
+
+    def predict(self, features):
+        if len(self.counts) < 2:
+            raise NotFittedError("at least two gestures need samples")
+
+        features = np.asarray(features, dtype=np.float64).reshape(len(features), -1)
+        if features.shape[1] != self.n_features:
+            raise ValueError("feature length does not match the learned samples")
+
+        labels = list(self.counts)
+        counts = np.array([self.counts[label] for label in labels], dtype=np.float64)[:, None]
+        means = np.array([self.sums[label] for label in labels]) / counts
+        squares = np.array([self.squares[label] for label in labels])
+        within = (squares - counts * means ** 2).sum(axis=0) / max(counts.sum() - len(labels), 1)
+        scale = np.sqrt(np.maximum(within, 1e-12))
+
+        distances = (((features[:, None, :] - means[None]) / scale) ** 2).sum(axis=2)
+        return np.array(labels)[distances.argmin(axis=1)]
+
+
+# decides when the SvmNode predicts in prediction mode and which label it outputs
+# a prediction is made every `hop` new samples instead of on every update, as consecutive windows
+# overlap almost completely. the last `votes` predictions are smoothed by majority vote and
+# the output label only changes after another label has won `hysteresis` votes in a row.
+# push() returns the new label when the output changes and None otherwise
+class PredictionScheduler:
+
+    def __init__(self, hop=8, votes=5, hysteresis=2):
+        self.hop = hop
+        self.votes = votes
+        self.hysteresis = hysteresis
+        self.reset()
+
+    def reset(self):
+        self.pending = 0
+        self.history = deque(maxlen=self.votes)
+        self.label = None
+        self.candidate = None
+        self.candidate_wins = 0
+
+    def set_hop(self, hop):
+        self.hop = max(1, int(hop))
+
+    def set_votes(self, votes):
+        self.votes = max(1, int(votes))
+        self.history = deque(self.history, maxlen=self.votes)
+
+    # counts new samples, returns True if a prediction is due
+    # a single prediction is due even if more than `hop` samples arrived at once
+    def add_samples(self, count):
+        self.pending += count
+        if self.pending < self.hop:
+            return False
+        self.pending %= self.hop
+        return True
+
+    def push(self, label):
+        self.history.append(label)
+        winner = Counter(self.history).most_common(1)[0][0]
+        if winner == self.label:
+            self.candidate = None
+            self.candidate_wins = 0
+            return None
+
+        if winner == self.candidate:
+            self.candidate_wins += 1
+        else:
+            self.candidate = winner
+            self.candidate_wins = 1
+        # the first label is output right away
+        if self.label is not None and self.candidate_wins < self.hysteresis:
+            return None
+        self.label = winner
+        self.candidate = None
+        self.candidate_wins = 0
+        return winner
+
+
+# keeps the first `fraction` of the features, i.e. the low frequency bins of a spectrum from
+# the SpectrumStage. the recordings only hold features, so this is the feature choice the
+# tuner can make without recording again
+class SpectrumBand(BaseEstimator, TransformerMixin):
+
+    def __init__(self, fraction=1.0):
+        self.fraction = fraction
+
+    def fit(self, samples, targets=None):
+        return self
+
+    def transform(self, samples):
+        samples = np.asarray(samples)
+        return samples[:, :max(1, int(round(samples.shape[1] * self.fraction)))]
+
+
+# the svm of the GestureRecognizer for a parameter set of TUNING_GRID; missing parameters
+# keep the svm.SVC defaults, so create_model() is a plain svm.SVC()
+def create_model(params=None):
+    params = dict(params or {})
+    fraction = params.pop('band', 1.0)
+    model = svm.SVC(**params)
+    if fraction >= 1.0:
+        return model
+    return make_pipeline(SpectrumBand(fraction), model)
+
+
+# parameters searched by the GestureTuner: svm regularization and kernel width and the
+# fraction of the spectrum (see SpectrumBand) the svm is trained on
+TUNING_GRID = {
+    'C': (0.1, 1.0, 10.0, 100.0),
+    'gamma': ('scale', 0.001, 0.01, 0.1, 1.0),
+    'band': (1.0, 0.5, 0.25),
+}
+
+# samples and targets of a tuning, sent once to every worker process
+_tuning_data = None
+
+
+def _init_tuning_worker(samples, targets):
+    global _tuning_data
+    _tuning_data = samples, targets
+
+
+# runs in a worker process: the accuracy of one parameter set on one fold
+def _score_fold(params, train, test):
+    samples, targets = _tuning_data
+    model = create_model(params)
+    try:
+        model.fit(samples[train], targets[train])
+    except ValueError:
+        return 0.0
+    return model.score(samples[test], targets[test])
+
+
+# cross-validated search for the svm parameters with the best accuracy
+# searches the whole grid or, with `iterations`, that many random parameter sets of it.
+# every parameter set and fold is one task for a pool of `workers` processes (default: one
+# per core), so the search scales with the cores and progress is reported per task.
+# run() blocks; run it on a worker thread and cancel() it from any thread
+class GestureTuner:
+
+    def __init__(self, grid=TUNING_GRID, folds=5, iterations=None, workers=None, seed=0):
+        self.grid = grid
+        self.folds = folds
+        self.iterations = iterations
+        self.workers = workers or os.cpu_count() or 1
+        self.seed = seed
+        self._cancelled = threading.Event()
+
+    # the parameter sets to evaluate, as dicts
+    def candidates(self):
+        keys = list(self.grid)
+        candidates = [dict(zip(keys, values)) for values in product(*(self.grid[key] for key in keys))]
+        if self.iterations is not None and self.iterations < len(candidates):
+            candidates = random.Random(self.seed).sample(candidates, self.iterations)
+        return candidates
+
+    def cancel(self):
+        self._cancelled.set()
+
+    # returns the best model fitted on all samples, its parameters and its mean accuracy as
+    # (model, params, score), or None if cancelled. calls progress(done, total, params, score)
+    # with the best parameters so far after every task. raises ValueError if a gesture has
+    # fewer than two samples
+    def run(self, samples, targets, progress=None):
+        # a copy: the pool pickles it anyway and the recordings may grow meanwhile
+        samples = np.array(samples, dtype=np.float64)
+        targets = np.asarray(targets)
+        folds = min([self.folds] + list(Counter(targets).values()))
+        if folds < 2 or len(set(targets)) < 2:
+            raise ValueError("every gesture needs at least two samples")
+        splits = list(StratifiedKFold(folds, shuffle=True, random_state=self.seed).split(samples, targets))
+        candidates = self.candidates()
+
+        scores = [[] for _ in candidates]
+        best = None
+        total = len(candidates) * len(splits)
+        done = 0
+        # spawn, not fork: the gui process has Qt and sensor threads running
+        with ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'),
+                                 initializer=_init_tuning_worker, initargs=(samples, targets)) as pool:
+            tasks = {pool.submit(_score_fold, params, train, test): index
+                     for index, params in enumerate(candidates) for train, test in splits}
+            for task in as_completed(tasks):
+                if self._cancelled.is_set():
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    return None
+                index = tasks[task]
+                scores[index].append(task.result())
+                if len(scores[index]) == len(splits):
+                    score = float(np.mean(scores[index]))
+                    # ties go to the parameter set that comes first in the grid
+                    if best is None or (score, -index) > (best[1], -best[0]):
+                        best = index, score
+                done += 1
+                if progress is not None and best is not None:
+                    progress(done, total, candidates[best[0]], best[1])
+
+        params = candidates[best[0]]
+        model = create_model(params)
+        model.fit(samples, targets)
+        return model, params, best[1]
+
+
+# recording, training and prediction of gestures from feature vectors, used by the SvmNode
+# and the Pipeline. samples are kept in a RecordingStore, with a GestureStore set (set_store())
+# it is persistent and the trained models are saved and restored.
+# the classifier is either an svm (see create_model()), trained on all recorded samples, or an
+# IncrementalGestureClassifier that learns every recorded sample immediately.
+# train() trains synchronously; to train on another thread, run begin_training() and
+# install_model() on the owning thread and fit() on the other one. the previous model keeps
+# predicting until install_model() swaps in the new one
+class GestureRecognizer:
+
+    def __init__(self):
+        self.recordings = RecordingStore()
+        self.store = None
+        # the model version is the version of the recordings the current model was trained on
+        self.svc = svm.SVC()
+        # parameters of the svm (see create_model()), set by tuning
+        self.svm_params = {}
+        self.model_version = 0
+        self.training_version = None
+        # streaming alternative to the svm
+        self.incremental = False
+        self.incremental_model = IncrementalGestureClassifier()
+        self.scheduler = PredictionScheduler()
+
+    # the version of the recordings, changes with every recorded sample and every
+    # added or deleted gesture
+    @property
+    def dataset_version(self):
+        return self.recordings.version
+
+    @property
+    def classifier(self):
+        return "incremental" if self.incremental else "svm"
+
+    # restores gestures and model from the store and saves them there from now on
+    def set_store(self, store):
+        self.store = store
+        self.recordings = store.open_recordings()
+
+        state = store.load_model()
+        if state is not None:
+            self.svc = state['svc']
+            self.svm_params = state.get('svm_params', {})
+            self.incremental_model = state['incremental_model']
+            self.model_version = state['model_version']
+            self.incremental = state['classifier'] == "incremental"
+
+    def save_model(self):
+        if self.store is None:
+            return
+        self.store.save_model({
+            'classifier': self.classifier,
+            'svc': self.svc,
+            'svm_params': self.svm_params,
+            'incremental_model': self.incremental_model,
+            'model_version': self.model_version,
+        })
+
+    def gestures(self):
+        return self.recordings.gestures()
+
+    def add_gesture(self, name):
+        self.recordings.add_gesture(name)
+        self.recordings.flush()
+
+    # only marks the samples as deleted, they are removed before the next training
+    def delete_gesture(self, name):
+        self.incremental_model.remove_label(name)
+        self.recordings.delete_gesture(name)
+        self.recordings.flush()
+
+    # records one feature vector of a gesture. raises ValueError if the gesture is unknown
+    # or the feature does not fit the recordings (e.g. the buffer size was changed)
+    # features should come from full windows (see BufferStage), the length of a spectrum of
+    # a filling buffer does not change with every sample
+    def record(self, name, feature):
+        feature = np.array(feature).flatten()
+        if len(feature) == 0:
+            raise ValueError("empty feature")
+        width = self.recordings.width
+        if self.training_version is not None and width is not None and width != len(feature):
+            # a new feature length remaps the recordings the training is reading
+            raise ValueError(f"expected {width} features while training, got {len(feature)}")
+        self.recordings.append(name, feature)
+        if self.incremental:
+            self.incremental_model.partial_fit(feature, name)
+            self.model_version = self.dataset_version
+
+    # switches between the svm and the incremental classifier
+    # the incremental classifier learns all samples recorded so far once
+    def set_incremental(self, incremental):
+        self.incremental = incremental
+        if self.incremental:
+            self.incremental_model.reset()
+            for gesture in self.recordings.gestures():
+                for features in self.recordings.gesture_features(gesture):
+                    for feature in features:
+                        self.incremental_model.partial_fit(feature, gesture)
+        # the svm may not have seen the latest samples
+        self.model_version = 0
+
+    # starts a training if the recorded data changed since the last one and no training is
+    # running; at least two gestures need samples. returns the arguments for fit() and
+    # install_model() as (samples, targets, version) or None if there is nothing to train.
+    # the incremental classifier is always up to date, its version is just updated
+    def begin_training(self):
+        if self.incremental:
+            if self.model_version != self.dataset_version:
+                self.model_version = self.dataset_version
+                self.save_model()
+            return None
+        if self.training_version is not None or self.dataset_version == self.model_version:
+            return None
+        if sum(1 for count in self.recordings.counts().values() if count) < 2:
+            return None
+
+        # the feature matrix is a view into the recordings. while training, rows are only
+        # appended: compact() only runs in training_data() and when the feature length
+        # changes, which record() refuses until the training is installed or cancelled
+        samples, targets = self.recordings.training_data()
+        self.training_version = self.dataset_version
+        return samples, targets, self.training_version
+
+    # starts a tuning (see GestureTuner) on the recorded data, even if the model is up to
+    # date; returns (samples, targets, version) like begin_training() or None if the svm is
+    # not used, a training is running or less than two gestures have samples.
+    # finish it with install_tuned_model() or cancel_training()
+    def begin_tuning(self):
+        if self.incremental or self.training_version is not None:
+            return None
+        if sum(1 for count in self.recordings.counts().values() if count) < 2:
+            return None
+        samples, targets = self.recordings.training_data()
+        self.training_version = self.dataset_version
+        return samples, targets, self.training_version
+
+    # ends a training or tuning without a new model
+    def cancel_training(self):
+        self.training_version = None
+
+    # may run on any thread, returns the fitted svm or None
+    @staticmethod
+    def fit(samples, targets, params=None):
+        svc = create_model(params)
+        try:
+            svc.fit(samples, targets)
+        except ValueError:
+            return None
+        return svc
+
+    # swaps in a model returned by fit(), returns False if it was dropped because the
+    # classifier was switched to the incremental one while training
+    def install_model(self, svc, version):
+        self.training_version = None
+        if self.incremental:
+            return False
+        self.model_version = version
+        if svc is not None:
+            self.svc = svc
+        self.save_model()
+        return True
+
+    # swaps in the model found by a GestureTuner; later trainings use its parameters
+    def install_tuned_model(self, model, params, version):
+        if not self.incremental:
+            self.svm_params = dict(params)
+        return self.install_model(model, version)
+
+    def train(self):
+        training = self.begin_training()
+        if training is not None:
+            samples, targets, version = training
+            self.install_model(self.fit(samples, targets, self.svm_params), version)
+
+    # the gesture of one feature vector, None without a usable model
+    def classify(self, feature):
+        # the model may be swapped by a finished training at any time
+        model = self.incremental_model if self.incremental else self.svc
+        try:
+            prediction = model.predict([feature])[0]
+        except (NotFittedError, ValueError):
+            return None
+        # the model may still know a gesture that was deleted since it was trained
+        if not self.recordings.has_gesture(prediction):
+            return None
+        return prediction
+
+    # classifies every `hop` samples (see PredictionScheduler) and returns the smoothed
+    # gesture when it changes, None otherwise
+    def predict(self, feature, samples=1):
+        if not self.scheduler.add_samples(samples):
+            return None
+        prediction = self.classify(feature)
+        if prediction is None:
+            return None
+        return self.scheduler.push(prediction)
+
+
+# the whole recognizer: push() takes a block of accelerometer samples (n x 3) and returns the
+# predicted gesture when it changes, None otherwise. with a gesture name, the block is
+# recorded for that gesture instead; call recognizer.train() after recording
+class Pipeline:
+
+    def __init__(self, recognizer=None, buffer_size=32, threshold=0.01, hold=10, incremental_fft=False):
+        self.buffer = BufferStage(buffer_size)
+        self.gate = MotionGate(threshold, hold)
+        self.spectrum = SpectrumStage(incremental_fft)
+        self.recognizer = recognizer if recognizer is not None else GestureRecognizer()
+
+    # the feature vector of the current window, None while the device is idle
+    def features(self, block):
+        return self.spectrum.process(self.gate.process(self.buffer.process(block)), len(block))
+
+    def push(self, block, gesture=None):
+        feature = self.features(block)
+        if feature is None:
+            return None
+        if gesture is not None:
+            self.recognizer.record(gesture, feature)
+            return None
+        return self.recognizer.predict(feature, len(block))
+
+    # yields every change of the predicted gesture for an iterable of blocks
+    def run(self, blocks):
+        for block in blocks:
+            gesture = self.push(block)
+            if gesture is not None:
+                yield gesture
+
+
+# the accelerometer samples of a DIPPID Sensor as blocks (n x 3) for Pipeline.run()
+# polls the sensor every `interval` seconds and never ends; stop iterating to stop
+def sensor_blocks(sensor, interval=0.02, capability='accelerometer'):
+    while True:
+        samples = sensor.drain_vectors(capability)
+        if len(samples):
+            yield samples[:, 1:]
+        else:
+            sleep(interval)
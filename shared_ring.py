@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# moves sensor samples from a receiver process to the GUI process through shared memory
+# SensorProcess runs a SensorUDP in a separate process that writes every decoded
+# accelerometer sample into a SharedSampleRing; the GUI process reads new samples as a
+# zero-copy numpy view. decoding packets then does not compete with Qt and sklearn
+# for the GIL, so the receiver keeps up at full rate while the svm trains or plots redraw
+import atexit
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from DIPPID import SensorUDP
+
+
+# ring buffer of samples (rows of `channels` float64 values) in shared memory, for one
+# writer and any number of readers in other processes
+# layout: a header of int64 slots (write sequence, capacity, channels) followed by the
+# samples; like RingBuffer every sample is written twice (at i and i + capacity), so new
+# samples can always be read as one contiguous view
+# the writer stores the samples before it advances the write sequence, so readers never
+# see a sample before it is complete
+class SharedSampleRing:
+    HEADER_SLOTS = 4
+    SEQUENCE, CAPACITY, CHANNELS = range(3)
+
+    # creates a new ring without a name, attaches to an existing one with a name
+    def __init__(self, name=None, capacity=8192, channels=4):
+        self.owner = name is None
+        if self.owner:
+            size = 8 * (self.HEADER_SLOTS + 2 * capacity * channels)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self._header = np.ndarray((self.HEADER_SLOTS,), dtype=np.int64, buffer=self.shm.buf)
+        if self.owner:
+            self._header[:] = 0
+            self._header[self.CAPACITY] = capacity
+            self._header[self.CHANNELS] = channels
+        self.capacity = int(self._header[self.CAPACITY])
+        self.channels = int(self._header[self.CHANNELS])
+        self._data = np.ndarray((2 * self.capacity, self.channels), dtype=np.float64,
+                                buffer=self.shm.buf, offset=8 * self.HEADER_SLOTS)
+        # readers start with the samples written after they attached
+        self._read_sequence = int(self._header[self.SEQUENCE])
+        # samples a reader missed because it fell more than a whole ring behind
+        self.lost = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # number of samples written since the ring was created
+    def written(self):
+        return int(self._header[self.SEQUENCE])
+
+    # appends samples (an iterable of rows); only the newest `capacity` samples are kept
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, self.channels)
+        # samples that do not fit still count, so readers know they missed them
+        sequence = int(self._header[self.SEQUENCE]) + max(len(samples) - self.capacity, 0)
+        samples = samples[-self.capacity:]
+        n = len(samples)
+        if n == 0:
+            return
+
+        head = sequence % self.capacity
+        first = min(n, self.capacity - head)
+        for offset in (0, self.capacity):
+            self._data[head + offset:head + offset + first] = samples[:first]
+            self._data[offset:offset + n - first] = samples[first:]
+        self._header[self.SEQUENCE] = sequence + n
+
+    # returns the samples written since the previous read as a read-only, zero-copy view
+    # the view is overwritten once the writer got another `capacity` samples ahead, so it
+    # should be used (or copied) right away
+    def read(self):
+        sequence = int(self._header[self.SEQUENCE])
+        count = sequence - self._read_sequence
+        if count > self.capacity:
+            self.lost += count - self.capacity
+            count = self.capacity
+        self._read_sequence = sequence
+
+        start = (sequence - count) % self.capacity
+        view = self._data[start:start + count]
+        view.flags.writeable = False
+        return view
+
+    def close(self):
+        self._header = None
+        self._data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # views returned by read() are still alive, the mapping goes with them
+            pass
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
+
+
+# SensorUDP that passes every accelerometer sample on to a SharedSampleRing
+class _RingSensorUDP(SensorUDP):
+    def __init__(self, ring, port, ip):
+        self._ring = ring
+        SensorUDP.__init__(self, port, ip)
+
+    def _handle_datagrams(self, datagrams):
+        SensorUDP._handle_datagrams(self, datagrams)
+        if self.has_capability('accelerometer'):
+            samples = self.drain_vectors('accelerometer')
+            if len(samples):
+                self._ring.write(samples)
+
+
+# runs in the receiver process until stop is set
+# reports None or the error that prevented receiving through the connection
+def _receive(ring_name, port, ip, stop, connection):
+    ring = SharedSampleRing(ring_name)
+    try:
+        sensor = _RingSensorUDP(ring, port, ip)
+    except OSError as e:
+        connection.send(str(e))
+        ring.close()
+        return
+    connection.send(None)
+    stop.wait()
+    sensor.disconnect()
+    ring.close()
+
+
+# receives accelerometer samples over UDP in a separate process
+# not a Sensor: it has no callbacks and only the accelerometer capability. drain_block()
+# returns the new samples as an n x 4 array (timestamp, x, y, z) that is a zero-copy view
+# into shared memory. raises OSError if the receiver process cannot open the port
+class SensorProcess:
+    START_TIMEOUT = 10.0
+
+    def __init__(self, port, ip='0.0.0.0', capacity=8192):
+        # spawn, not fork: the gui process has Qt and sensor threads running
+        context = multiprocessing.get_context('spawn')
+        self.ring = SharedSampleRing(capacity=capacity)
+        self._stop = context.Event()
+        receiver, sender = context.Pipe(duplex=False)
+        self._process = context.Process(target=_receive, args=(self.ring.name, port, ip, self._stop, sender),
+                                        daemon=True)
+        self._process.start()
+        atexit.register(self.disconnect)
+
+        error = receiver.recv() if receiver.poll(self.START_TIMEOUT) else 'receiver process did not start'
+        if error is not None:
+            self.disconnect()
+            raise OSError(error)
+
+    def has_capability(self, key):
+        return key == 'accelerometer' and self.ring.written() > 0
+
+    def drain_block(self):
+        return self.ring.read()
+
+    # samples that were overwritten before they were drained
+    def get_lost(self):
+        return self.ring.lost
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def disconnect(self):
+        if self.ring is None:
+            return
+        atexit.unregister(self.disconnect)
+        self._stop.set()
+        self._process.join(2)
+        if self._process.is_alive():
+            self._process.terminate()
+        self.ring.close()
+        self.ring = None
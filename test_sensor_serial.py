@@ -0,0 +1,145 @@
+# drives SensorSerial through a pseudo terminal that stands in for the usb device
+# the sensor opens a symlink to the pty, so the device can "disappear" and come back
+# run with: python -m pytest test_sensor_serial.py
+import os
+import json
+import threading
+from time import monotonic, sleep
+
+import pytest
+
+pytest.importorskip('serial')
+if not hasattr(os, 'openpty'):
+    pytest.skip('needs pseudo terminals', allow_module_level=True)
+
+from DIPPID import SensorSerial, encode_binary_frame
+
+
+class FakeDevice:
+    """
+    A pty with a symlink at path, like /dev/ttyUSB0 for a plugged-in device.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.plug()
+
+    def plug(self):
+        self.master, self.slave = os.openpty()
+        if os.path.lexists(self.path):
+            os.remove(self.path)
+        os.symlink(os.ttyname(self.slave), self.path)
+
+    def unplug(self):
+        os.remove(self.path)
+        os.close(self.master)
+        os.close(self.slave)
+        self.master = None
+
+    def write(self, data, chunk=None):
+        chunk = chunk or len(data)
+        for start in range(0, len(data), chunk):
+            os.write(self.master, data[start:start + chunk])
+
+    def close(self):
+        if self.master is not None:
+            self.unplug()
+
+
+# a sensor that remembers the delays between its reconnect attempts
+class BackoffSerial(SensorSerial):
+    RECONNECT_MIN_DELAY = 0.01
+    RECONNECT_MAX_DELAY = 0.08
+
+    def __init__(self, tty):
+        self.delays = []
+        SensorSerial.__init__(self, tty)
+
+    def _wait(self, delay):
+        self.delays.append(delay)
+        SensorSerial._wait(self, delay)
+
+
+def wait_for(condition, timeout=5.0):
+    end = monotonic() + timeout
+    while not condition():
+        if monotonic() > end:
+            return False
+        sleep(0.01)
+    return True
+
+
+def frame(i):
+    values = {'accelerometer': {'x': i, 'y': 0, 'z': 0}}
+    if i % 3 == 0:
+        return encode_binary_frame(values)
+    return json.dumps(values).encode() + b'\n'
+
+
+@pytest.fixture
+def device(tmp_path):
+    device = FakeDevice(str(tmp_path / 'ttyDIPPID'))
+    yield device
+    device.close()
+
+
+@pytest.fixture
+def sensors():
+    created = []
+    yield created
+    for sensor in created:
+        sensor.disconnect()
+
+
+def test_frames_split_across_reads(device, sensors):
+    sensor = SensorSerial(device.path)
+    sensors.append(sensor)
+    # odd chunks split json lines and binary frames at arbitrary bytes
+    device.write(b''.join(frame(i) for i in range(300)) + b'garbage line\n', chunk=37)
+
+    samples = []
+    assert wait_for(lambda: samples.extend(sensor.drain_vectors('accelerometer')) or len(samples) >= 300)
+    assert [int(sample[1]) for sample in samples] == list(range(300))
+    assert wait_for(lambda: sensor.get_stats()['malformed'] == 1)
+    assert sensor.get_stats()['received'] == 301
+
+
+def test_line_without_newline_is_discarded(device, sensors):
+    sensor = SensorSerial(device.path)
+    sensors.append(sensor)
+    device.write(b'x' * (SensorSerial.MAX_FRAME_SIZE + 10))
+    assert wait_for(lambda: sensor.get_stats()['malformed'] == 1)
+    # the tail of the garbage may arrive after the discard, end it as a line of its own
+    device.write(b'\n' + frame(1))
+    assert wait_for(lambda: len(sensor.drain_vectors('accelerometer')) == 1)
+
+
+def test_reconnects_with_backoff_on_one_thread(device, sensors):
+    sensor = BackoffSerial(device.path)
+    sensors.append(sensor)
+    device.write(frame(1))
+    assert wait_for(lambda: sensor.has_capability('accelerometer'))
+    threads = threading.active_count()
+
+    device.unplug()
+    # attempts double their delay up to the maximum
+    assert wait_for(lambda: len(sensor.delays) >= 6)
+    assert sensor.delays[:5] == [0.01, 0.02, 0.04, 0.08, 0.08]
+    assert threading.active_count() == threads
+
+    device.plug()
+    assert wait_for(lambda: sensor.get_stats()['reconnects'] == 1)
+    device.write(b''.join(frame(i) for i in range(10, 20)))
+    samples = []
+    assert wait_for(lambda: samples.extend(sensor.drain_vectors('accelerometer')) or len(samples) >= 11)
+    assert int(samples[-1][1]) == 19
+    assert threading.active_count() == threads
+
+
+def test_disconnect_while_unplugged(device):
+    sensor = BackoffSerial(device.path)
+    device.unplug()
+    assert wait_for(lambda: sensor.delays)
+    start = monotonic()
+    sensor.disconnect()
+    assert monotonic() - start < 1.0
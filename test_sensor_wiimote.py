@@ -0,0 +1,123 @@
+# drives SensorWiimote with a fake wiimote module instead of a bluetooth device
+# run with: python -m pytest test_sensor_wiimote.py
+import sys
+import types
+from time import sleep
+
+import numpy as np
+import pytest
+
+from DIPPID import SensorWiimote
+
+
+class FakeButtons:
+    BUTTONS = {'A': 0x0008, 'B': 0x0004, 'Up': 0x0800}
+
+    def __init__(self):
+        self.state = {button: False for button in self.BUTTONS}
+
+    def __getitem__(self, button):
+        return self.state[button]
+
+
+class FakeWiimote:
+    def __init__(self):
+        self.accelerometer = [512, 512, 612]
+        self.buttons = FakeButtons()
+
+
+@pytest.fixture
+def device(monkeypatch):
+    device = FakeWiimote()
+    module = types.ModuleType('wiimote')
+    module.connect = lambda btaddr: device
+    monkeypatch.setitem(sys.modules, 'wiimote', module)
+    return device
+
+
+@pytest.fixture
+def sensors():
+    created = []
+    yield created
+    for sensor in created:
+        sensor.disconnect()
+
+
+def test_polls_at_a_fixed_rate(device, sensors):
+    sensor = SensorWiimote('00:11:22:33:44:55', rate=200)
+    sensors.append(sensor)
+    sleep(0.5)
+    polls = sensor.drain_vectors('accelerometer')
+
+    assert 80 <= len(polls) <= 110
+    periods = np.diff([poll[0] for poll in polls])
+    assert abs(np.median(periods) - 0.005) < 0.001
+    # one frame per poll
+    assert sensor.get_stats()['received'] >= len(polls)
+
+
+def test_every_poll_is_one_frame(device, sensors):
+    sensor = SensorWiimote('00:11:22:33:44:55', rate=200)
+    sensors.append(sensor)
+    sleep(0.1)
+    device.accelerometer[0] = 700
+    sleep(0.1)
+
+    polls = sensor.drain_vectors('accelerometer')
+    assert tuple(polls[0][1:]) == (512, 512, 612)
+    assert tuple(polls[-1][1:]) == (700, 512, 612)
+    # the buttons are part of the first frame only, with its timestamp
+    for key in ('button_a', 'button_b', 'button_up'):
+        samples = sensor.drain_samples(key)
+        assert samples == [(polls[0][0], 0)]
+
+
+def test_buttons_are_reported_on_change(device, sensors):
+    sensor = SensorWiimote('00:11:22:33:44:55', rate=200)
+    sensors.append(sensor)
+    changes = []
+    sensor.register_callback('button_a', changes.append)
+    sensor.register_callback('button_b', lambda value: changes.append(('b', value)))
+    sleep(0.1)
+
+    device.buttons.state['A'] = True
+    sleep(0.1)
+    device.buttons.state['A'] = False
+    sleep(0.1)
+
+    assert changes == [1, 0]
+    assert [value for _, value in sensor.drain_samples('button_a')] == [0, 1, 0]
+    assert [value for _, value in sensor.drain_samples('button_b')] == [0]
+
+
+def test_snapshot_bitmask(device, sensors):
+    sensor = SensorWiimote('00:11:22:33:44:55', rate=200)
+    sensors.append(sensor)
+    buttons = list(FakeButtons.BUTTONS)
+    device.buttons.state['B'] = True
+    device.buttons.state['Up'] = True
+    vector, mask = sensor._snapshot(buttons)
+    assert vector == {'x': 512, 'y': 512, 'z': 612}
+    assert mask == 0b110
+
+
+def test_stall_skips_missed_polls(device, sensors):
+    sensor = SensorWiimote('00:11:22:33:44:55', rate=200)
+    sensors.append(sensor)
+    sleep(0.05)
+    original = sensor._snapshot
+
+    # one poll takes 100 ms
+    def slow_snapshot(buttons, stalled=[True]):
+        if stalled:
+            stalled.pop()
+            sleep(0.1)
+        return original(buttons)
+
+    sensor._snapshot = slow_snapshot
+    sleep(0.3)
+    polls = sensor.drain_vectors('accelerometer')
+    gaps = np.diff([poll[0] for poll in polls])
+    assert gaps.max() >= 0.09
+    # no burst of the ~20 missed polls right after the stall, only scheduling jitter
+    assert np.sum(gaps < 0.002) <= 5
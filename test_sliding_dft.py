@@ -0,0 +1,63 @@
+# checks that the incremental spectrum of the SpectrumStage matches a full fft
+# run with: python -m pytest test_sliding_dft.py
+import numpy as np
+import pytest
+
+from pipeline import BufferStage, SpectrumStage, SlidingDFT
+
+
+def full_spectrum(window):
+    avg = window.mean(axis=1)
+    return np.abs(np.fft.fft(avg) / len(avg))[1:len(avg) // 2]
+
+
+@pytest.mark.parametrize('size', [8, 32, 33, 128])
+def test_sliding_spectrum_matches_fft(size):
+    rng = np.random.default_rng(size)
+    buffer = BufferStage(size)
+    spectrum = SpectrumStage(incremental=True)
+    compared = 0
+    slid = 0
+    for _ in range(500):
+        # blocks of 1 to 5 samples, sometimes longer than the window
+        block = rng.normal(size=(rng.integers(1, 6) if rng.random() > 0.02 else size + 3, 3))
+        window = buffer.process(block)
+        if window is None:
+            continue
+        np.testing.assert_allclose(spectrum.process(window, len(block)), full_spectrum(window), rtol=0, atol=1e-12)
+        compared += 1
+        slid += spectrum.sliding_dft.since_resync > 0
+    assert compared > 400
+    # the spectrum was slid, not recomputed every time
+    assert slid > compared // 2
+
+
+def test_sliding_spectrum_resyncs_on_wrong_sample_count():
+    rng = np.random.default_rng(2)
+    buffer = BufferStage(32)
+    spectrum = SpectrumStage(incremental=True)
+    for _ in range(100):
+        block = rng.normal(size=(3, 3))
+        window = buffer.process(block)
+        if window is not None:
+            # e.g. samples a closed MotionGate held back
+            np.testing.assert_allclose(spectrum.process(window, 2), full_spectrum(window), rtol=0, atol=1e-12)
+
+
+def test_sliding_spectrum_resyncs_on_unrelated_window():
+    rng = np.random.default_rng(0)
+    spectrum = SpectrumStage(incremental=True)
+    for _ in range(3):
+        window = rng.normal(size=(32, 3))
+        np.testing.assert_allclose(spectrum.process(window, 1), full_spectrum(window), rtol=0, atol=1e-12)
+
+
+def test_rounding_errors_stay_small_without_resync():
+    rng = np.random.default_rng(1)
+    samples = rng.normal(size=5000)
+    dft = SlidingDFT(64, resync_interval=len(samples))
+    dft.resync(samples[:64])
+    for i in range(64, len(samples)):
+        dft.update(samples[i:i + 1])
+    expected = np.abs(np.fft.fft(samples[-64:]) / 64)[1:32]
+    np.testing.assert_allclose(dft.magnitudes(), expected, rtol=0, atol=1e-9)